@@ -0,0 +1,262 @@
+# prueba de carga de la cadena productos -> pedidos -> pagos
+# levanta los tres servicios en puertos propios con bases temporales , siembra el catalogo , genera carga
+# y reporta en JSON el throughput y la latencia p50/p95/p99 por endpoint (para comparar entre versiones)
+#
+# uso:  python benchmarks/carga.py --duracion 20 --concurrencia 16 --salida resultado.json
+#       python benchmarks/carga.py --escenario caida_productos --tasa 100
+#       python benchmarks/carga.py --comparar base.json --salida nuevo.json
+import argparse, json, math, os, random, shutil, sqlite3, subprocess, sys, tempfile, threading, time
+from collections import defaultdict
+import requests
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # carpeta raiz del proyecto
+TOKEN_SECRETO = "mi_token_secreto"
+ENCABEZADOS = {"Authorization": f"Bearer {TOKEN_SECRETO}"}
+ESCENARIOS = ("feliz", "lecturas", "caida_productos")
+
+
+class Servicios:
+    # levanta productos , pedidos y pagos como procesos hijos , cada uno con su base en una carpeta temporal
+    def __init__(self, puerto_base, modo_async=False, entorno=None):
+        self.carpeta = tempfile.mkdtemp(prefix="bench_microservicios_")
+        self.puertos = {"productos": puerto_base, "pedidos": puerto_base + 1, "pagos": puerto_base + 2}
+        self.modo_async = modo_async
+        self.entorno = entorno or {}   # variables extra para los servicios , propias del escenario
+        self.procesos = {}
+
+    def url(self, servicio):
+        return f"http://127.0.0.1:{self.puertos[servicio]}"
+
+    def iniciar(self):
+        entorno = dict(os.environ)
+        entorno.update({
+            "PRODUCTOS_DB": os.path.join(self.carpeta, "productos.db"),
+            "PEDIDOS_DB": os.path.join(self.carpeta, "pedidos.db"),
+            "PAGOS_DB": os.path.join(self.carpeta, "pagos.db"),
+            "PRODUCTOS_PUERTO": str(self.puertos["productos"]),
+            "PEDIDOS_PUERTO": str(self.puertos["pedidos"]),
+            "PAGOS_PUERTO": str(self.puertos["pagos"]),
+            "URL_SERVICIO_PRODUCTOS": f"{self.url('productos')}/productos",
+            "URL_SERVICIO_PEDIDOS": f"{self.url('pedidos')}/pedidos",
+            "MODO_ASYNC": "1" if self.modo_async else "0",
+        })
+        entorno.update(self.entorno)
+        for servicio in ("productos", "pedidos", "pagos"):
+            registro = open(os.path.join(self.carpeta, f"{servicio}.log"), "w")  # la salida de cada servicio queda en un archivo , no en un pipe que se pueda llenar
+            self.procesos[servicio] = subprocess.Popen(
+                [sys.executable, "app.py"], cwd=os.path.join(RAIZ, f"{servicio}_service"),
+                env=entorno, stdout=registro, stderr=subprocess.STDOUT
+            )
+        for servicio, ruta in (("productos", "/productos?limit=1"), ("pedidos", "/circuito"), ("pagos", "/circuito")):
+            self._esperar(servicio, ruta)
+
+    def _esperar(self, servicio, ruta, limite=20.0):   # espera a que el servicio responda
+        fin = time.monotonic() + limite
+        while time.monotonic() < fin:
+            if self.procesos[servicio].poll() is not None:
+                raise RuntimeError(f"El servicio {servicio} termino al arrancar , ver {self.carpeta}/{servicio}.log")
+            try:
+                if requests.get(self.url(servicio) + ruta, headers=ENCABEZADOS, timeout=1).status_code == 200:
+                    return
+            except requests.exceptions.RequestException:
+                pass
+            time.sleep(0.1)
+        raise RuntimeError(f"El servicio {servicio} no respondio en {limite} segundos")
+
+    def sembrar_catalogo(self, cantidad):   # carga el catalogo directo en la base de productos , mucho mas rapido que por HTTP
+        with sqlite3.connect(os.path.join(self.carpeta, "productos.db"), timeout=10) as db:
+            db.executemany(
+                "INSERT INTO productos (nombre, precio, actualizado_en) VALUES (?, ?, ?)",
+                ((f"Producto {i}", round(random.uniform(1, 1000), 2), int(time.time())) for i in range(cantidad))
+            )
+        return list(range(1, cantidad + 1))
+
+    def sembrar_pedidos(self, ids_productos, cantidad):   # pedidos existentes para los caminos de lectura
+        with sqlite3.connect(os.path.join(self.carpeta, "pedidos.db"), timeout=10) as db:
+            db.executemany(
+                "INSERT INTO pedidos (id_producto, cantidad, estado) VALUES (?, ?, ?)",
+                ((random.choice(ids_productos), random.randint(1, 5), "creado") for _ in range(cantidad))
+            )
+        return list(range(1, cantidad + 1))
+
+    def detener(self, servicio):   # Escenario B : apagar un servicio a mitad de la prueba
+        proceso = self.procesos[servicio]
+        if proceso.poll() is None:
+            proceso.terminate()   # SIGTERM en linux y mac , TerminateProcess en windows (alli send_signal solo acepta SIGTERM y CTRL_*_EVENT)
+            try:
+                proceso.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proceso.kill()
+
+    def cerrar(self):
+        for servicio in self.procesos:
+            self.detener(servicio)
+        shutil.rmtree(self.carpeta, ignore_errors=True)
+
+
+class Mediciones:
+    # guarda la latencia y el codigo de estado de cada peticion , separadas por fase y endpoint
+    def __init__(self):
+        self._datos = defaultdict(lambda: defaultdict(lambda: {"latencias": [], "estados": defaultdict(int)}))
+        self._candado = threading.Lock()
+        self.fase = "carga"
+
+    def registrar(self, endpoint, estado, segundos):
+        with self._candado:
+            datos = self._datos[self.fase][endpoint]
+            datos["latencias"].append(segundos * 1000)
+            datos["estados"][str(estado)] += 1
+
+    def resumen(self, duraciones):   # arma el reporte con throughput y percentiles por fase y endpoint
+        reporte = {}
+        for fase, endpoints in self._datos.items():
+            reporte[fase] = {"duracion_s": round(duraciones[fase], 3), "endpoints": {}}
+            for endpoint, datos in sorted(endpoints.items()):
+                latencias = sorted(datos["latencias"])
+                reporte[fase]["endpoints"][endpoint] = {
+                    "peticiones": len(latencias),
+                    "por_segundo": round(len(latencias) / duraciones[fase], 2) if duraciones[fase] else 0.0,
+                    "p50_ms": percentil(latencias, 50),
+                    "p95_ms": percentil(latencias, 95),
+                    "p99_ms": percentil(latencias, 99),
+                    "max_ms": round(latencias[-1], 3) if latencias else None,
+                    "estados": dict(datos["estados"]),
+                }
+        return reporte
+
+
+def percentil(valores_ordenados, p):   # percentil por rango mas cercano
+    if not valores_ordenados:
+        return None
+    indice = min(len(valores_ordenados), max(1, math.ceil(p / 100 * len(valores_ordenados)))) - 1
+    return round(valores_ordenados[indice], 3)
+
+
+def pedir(sesion, mediciones, endpoint, metodo, url, **kwargs):   # hace la peticion y la mide , los errores de conexion cuentan como estado "error"
+    inicio = time.perf_counter()
+    try:
+        respuesta = sesion.request(metodo, url, headers=ENCABEZADOS, timeout=10, **kwargs)
+        mediciones.registrar(endpoint, respuesta.status_code, time.perf_counter() - inicio)
+        return respuesta
+    except requests.exceptions.RequestException:
+        mediciones.registrar(endpoint, "error", time.perf_counter() - inicio)
+        return None
+
+
+def camino_feliz(sesion, servicios, mediciones, ids_productos, ids_pedidos):   # Escenario A : crear producto , crear pedido y pagarlo
+    pedir(sesion, mediciones, "POST /productos", "POST", f"{servicios.url('productos')}/productos",
+          json={"nombre": "Teclado", "precio": 150.0})
+    respuesta = pedir(sesion, mediciones, "POST /pedidos", "POST", f"{servicios.url('pedidos')}/pedidos",
+                      json={"id_producto": random.choice(ids_productos), "cantidad": random.randint(1, 5)})
+    if respuesta is not None and respuesta.status_code == 201:
+        pedir(sesion, mediciones, "POST /pagos", "POST", f"{servicios.url('pagos')}/pagos",
+              json={"id_pedido": respuesta.json()["id"]})
+
+
+def lecturas(sesion, servicios, mediciones, ids_productos, ids_pedidos):   # caminos de lectura
+    pedir(sesion, mediciones, "GET /productos/<id>", "GET", f"{servicios.url('productos')}/productos/{random.choice(ids_productos)}")
+    pedir(sesion, mediciones, "GET /productos?after&limit", "GET",
+          f"{servicios.url('productos')}/productos?after={random.choice(ids_productos)}&limit=100")
+    pedir(sesion, mediciones, "GET /pedidos/<id>", "GET", f"{servicios.url('pedidos')}/pedidos/{random.choice(ids_pedidos)}")
+
+
+def generar_carga(operacion, servicios, mediciones, ids_productos, ids_pedidos, duracion, concurrencia, tasa):
+    # corre la operacion desde varios hilos durante la duracion indicada
+    # con tasa , cada hilo la ejecuta a intervalos fijos (tasa total repartida entre los hilos) , sin tasa lo mas rapido posible
+    fin = time.monotonic() + duracion
+    intervalo = concurrencia / tasa if tasa else 0.0
+
+    def trabajador():
+        sesion = requests.Session()   # conexiones keep-alive por hilo , como un cliente real
+        proxima = time.monotonic() + random.uniform(0, intervalo)   # desfasamos los hilos para no disparar todos juntos
+        while time.monotonic() < fin:
+            if intervalo:
+                espera = proxima - time.monotonic()
+                if espera > 0:
+                    time.sleep(espera)
+                proxima += intervalo
+            operacion(sesion, servicios, mediciones, ids_productos, ids_pedidos)
+
+    hilos = [threading.Thread(target=trabajador) for _ in range(concurrencia)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+
+def correr_escenario(nombre, argumentos):
+    entorno = {}
+    if nombre == "caida_productos":
+        # sin cache de productos en pedidos : con el TTL de 30 s los pedidos de productos ya vistos seguirian saliendo bien
+        # durante la caida y la fase no mediria ni los 503 ni el circuito , asi cada pedido depende de productos
+        entorno = {"CACHE_PRODUCTOS_TTL": "0", "CACHE_PRODUCTOS_TTL_NEGATIVO": "0"}
+    servicios = Servicios(argumentos.puerto_base, argumentos.modo_async, entorno)
+    mediciones = Mediciones()
+    duraciones = {}
+    try:
+        servicios.iniciar()
+        ids_productos = servicios.sembrar_catalogo(argumentos.productos)
+        ids_pedidos = servicios.sembrar_pedidos(ids_productos, argumentos.pedidos)
+        operacion = lecturas if nombre == "lecturas" else camino_feliz
+        if nombre == "caida_productos":   # Escenario B : la primera mitad con todo arriba , la segunda con productos apagado
+            mitad = argumentos.duracion / 2
+            for fase in ("antes_de_la_caida", "durante_la_caida"):
+                mediciones.fase = fase
+                inicio = time.monotonic()
+                generar_carga(operacion, servicios, mediciones, ids_productos, ids_pedidos, mitad, argumentos.concurrencia, argumentos.tasa)
+                duraciones[fase] = time.monotonic() - inicio
+                if fase == "antes_de_la_caida":
+                    servicios.detener("productos")
+        else:
+            inicio = time.monotonic()
+            generar_carga(operacion, servicios, mediciones, ids_productos, ids_pedidos, argumentos.duracion, argumentos.concurrencia, argumentos.tasa)
+            duraciones["carga"] = time.monotonic() - inicio
+    finally:
+        servicios.cerrar()
+    return mediciones.resumen(duraciones)
+
+
+def comparar(base, nuevo):   # imprime la diferencia de throughput y p99 contra un reporte anterior
+    for escenario, fases in nuevo["escenarios"].items():
+        for fase, datos in fases.items():
+            for endpoint, valores in datos["endpoints"].items():
+                anterior = base.get("escenarios", {}).get(escenario, {}).get(fase, {}).get("endpoints", {}).get(endpoint)
+                if not anterior or not anterior["p99_ms"] or not valores["p99_ms"]:
+                    continue
+                print(f"{escenario}/{fase} {endpoint}: "
+                      f"{anterior['por_segundo']} -> {valores['por_segundo']} req/s , "
+                      f"p99 {anterior['p99_ms']} -> {valores['p99_ms']} ms ({(valores['p99_ms'] / anterior['p99_ms'] - 1) * 100:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de productos -> pedidos -> pagos")
+    parser.add_argument("--escenario", choices=ESCENARIOS + ("todos",), default="todos")
+    parser.add_argument("--duracion", type=float, default=10.0, help="segundos de carga por escenario")
+    parser.add_argument("--concurrencia", type=int, default=8, help="hilos generando carga")
+    parser.add_argument("--tasa", type=float, default=None, help="peticiones (operaciones) por segundo objetivo , sin esto va a maxima velocidad")
+    parser.add_argument("--productos", type=int, default=1000, help="tamano del catalogo sembrado")
+    parser.add_argument("--pedidos", type=int, default=1000, help="pedidos sembrados para los caminos de lectura")
+    parser.add_argument("--puerto-base", type=int, default=5100, help="productos usa este puerto , pedidos el siguiente y pagos el otro")
+    parser.add_argument("--modo-async", action="store_true", help="levanta pedidos y pagos con MODO_ASYNC=1")
+    parser.add_argument("--salida", help="archivo donde guardar el reporte JSON (por defecto se imprime)")
+    parser.add_argument("--comparar", help="reporte JSON anterior para comparar")
+    argumentos = parser.parse_args()
+
+    escenarios = ESCENARIOS if argumentos.escenario == "todos" else (argumentos.escenario,)
+    reporte = {
+        "configuracion": {clave: valor for clave, valor in vars(argumentos).items() if clave not in ("salida", "comparar")},
+        "escenarios": {nombre: correr_escenario(nombre, argumentos) for nombre in escenarios},
+    }
+    texto = json.dumps(reporte, indent=2)
+    if argumentos.salida:
+        with open(argumentos.salida, "w") as archivo:
+            archivo.write(texto)
+    else:
+        print(texto)
+    if argumentos.comparar:
+        with open(argumentos.comparar) as archivo:
+            comparar(json.load(archivo), reporte)
+
+
+if __name__ == "__main__":
+    main()
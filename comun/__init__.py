@@ -0,0 +1 @@
+# paquete con el codigo compartido entre los microservicios (cliente http , etc)
@@ -0,0 +1,141 @@
+import os, queue, sqlite3, threading, time
+from contextlib import contextmanager   # para usar el pool con "with"
+from comun import trazas
+from comun.metricas import OPERACIONES_DB
+
+
+class CursorMedido(sqlite3.Cursor):   # cursor que mide cada consulta para las metricas y los tiempos por etapa
+    def execute(self, sql, parametros=()):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(sql, parametros)
+        finally:
+            _medir(sql, time.perf_counter() - inicio)
+
+    def executemany(self, sql, parametros):
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(sql, parametros)
+        finally:
+            _medir(sql, time.perf_counter() - inicio)
+
+
+class ConexionMedida(sqlite3.Connection):   # conexion cuyas consultas y commits quedan medidos
+    def cursor(self, factory=CursorMedido):
+        return super().cursor(factory)
+
+    def execute(self, sql, parametros=()):   # el execute de sqlite3 no pasa por cursor() , lo redirigimos para medirlo
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql, parametros):
+        return self.cursor().executemany(sql, parametros)
+
+    def commit(self):
+        inicio = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            _medir("COMMIT", time.perf_counter() - inicio)
+
+
+def _medir(sql, segundos):
+    operacion = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else "VACIA"   # SELECT , INSERT , PRAGMA , ...
+    OPERACIONES_DB.observar(segundos, operacion)
+    trazas.sumar_etapa("db", segundos)
+
+
+class PoolAgotado(sqlite3.OperationalError):   # no hubo conexion libre a tiempo , los servicios lo responden con 503
+    pass
+
+
+class PoolConexiones:
+    # pool de conexiones sqlite por proceso , las conexiones se reutilizan entre peticiones en vez de abrir una nueva cada vez
+    # al reutilizarlas tambien se reutiliza el cache de sentencias preparadas de cada conexion
+    def __init__(self, ruta, tamano=8, synchronous="NORMAL", cache_size=-8000, mmap_size=64 * 1024 * 1024,
+                 busy_timeout=5000, sentencias_cacheadas=128, espera=5.0):
+        self.ruta = ruta
+        self.tamano = tamano   # cantidad maxima de conexiones abiertas
+        self.synchronous = synchronous   # NORMAL es seguro con WAL y hace menos fsync que FULL
+        self.cache_size = cache_size   # negativo = tamano en KiB del cache de paginas de cada conexion
+        self.mmap_size = mmap_size   # bytes de la base que se leen con memoria mapeada
+        self.busy_timeout = busy_timeout   # milisegundos que se espera un bloqueo de escritura antes de fallar
+        self.sentencias_cacheadas = sentencias_cacheadas   # sentencias preparadas que guarda cada conexion
+        self.espera = espera   # segundos que se espera una conexion libre cuando el pool esta lleno
+        self._libres = queue.LifoQueue()   # LIFO , reutiliza la conexion mas reciente (con el cache mas caliente)
+        self._creadas = 0
+        self._esperas = 0
+        self._candado = threading.Lock()
+
+    @classmethod
+    def desde_entorno(cls, ruta, **ajustes):
+        # construye el pool leyendo la configuracion de variables de entorno , con valores por defecto
+        # ajustes reemplaza valores puntuales (ej. un pool chico aparte para los listados que se envian por partes)
+        configuracion = dict(
+            tamano=int(os.environ.get("SQLITE_POOL_TAMANO", 8)),
+            synchronous=os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+            cache_size=int(os.environ.get("SQLITE_CACHE_SIZE", -8000)),
+            mmap_size=int(os.environ.get("SQLITE_MMAP_SIZE", 64 * 1024 * 1024)),
+            busy_timeout=int(os.environ.get("SQLITE_BUSY_TIMEOUT", 5000)),
+            sentencias_cacheadas=int(os.environ.get("SQLITE_SENTENCIAS_CACHEADAS", 128)),
+        )
+        configuracion.update(ajustes)
+        return cls(ruta, **configuracion)
+
+    def _crear(self):   # abre una conexion nueva y le aplica los pragmas
+        conexion = sqlite3.connect(
+            self.ruta,
+            timeout=self.busy_timeout / 1000,
+            check_same_thread=False,   # la conexion pasa de un hilo a otro a traves del pool , pero nunca la usan dos a la vez
+            cached_statements=self.sentencias_cacheadas,
+            factory=ConexionMedida
+        )
+        conexion.row_factory = sqlite3.Row   # para que las filas devueltas sean accesibles como diccionarios
+        conexion.execute("PRAGMA journal_mode=WAL")   # con WAL los lectores no bloquean al escritor ni el escritor a los lectores
+        conexion.execute(f"PRAGMA synchronous={self.synchronous}")
+        conexion.execute(f"PRAGMA cache_size={int(self.cache_size)}")
+        conexion.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conexion.execute(f"PRAGMA busy_timeout={int(self.busy_timeout)}")
+        return conexion
+
+    def conexion_dedicada(self):   # conexion propia para un hilo de fondo , con los mismos pragmas pero fuera del limite del pool
+        return self._crear()
+
+    def obtener(self):   # saca una conexion libre , crea una si no llegamos al tamano maximo , o espera a que se libere una
+        try:
+            return self._libres.get_nowait()
+        except queue.Empty:
+            pass
+        with self._candado:
+            crear = self._creadas < self.tamano
+            if crear:
+                self._creadas += 1
+            else:
+                self._esperas += 1
+        if crear:
+            try:
+                return self._crear()
+            except sqlite3.Error:
+                with self._candado:
+                    self._creadas -= 1
+                raise
+        try:
+            return self._libres.get(timeout=self.espera)
+        except queue.Empty:
+            raise PoolAgotado(f"No hay conexiones libres en el pool de {self.ruta}")   # subclase del error de un bloqueo de sqlite
+
+    def devolver(self, conexion):   # devuelve la conexion al pool , deshaciendo cualquier transaccion que haya quedado abierta
+        if conexion.in_transaction:
+            conexion.rollback()
+        self._libres.put(conexion)
+
+    @contextmanager
+    def conexion(self):   # uso: with pool.conexion() as db: ...
+        conexion = self.obtener()
+        try:
+            yield conexion
+        finally:
+            self.devolver(conexion)
+
+    def estadisticas(self):
+        with self._candado:
+            return {"tamano": self.tamano, "creadas": self._creadas, "libres": self._libres.qsize(), "esperas": self._esperas}
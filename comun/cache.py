@@ -0,0 +1,63 @@
+import threading, time
+from collections import OrderedDict   # diccionario que recuerda el orden , lo usamos para saber cual es el menos usado
+
+
+class CacheLRU:
+    # cache en memoria con tiempo de vida (TTL) y expulsion del menos usado (LRU) cuando se llena
+    # las entradas vencidas no se borran al leerlas , se devuelven marcadas como no vigentes para poder revalidarlas
+    def __init__(self, capacidad=1000, ttl=30.0):
+        self.capacidad = capacidad   # cantidad maxima de entradas
+        self.ttl = ttl   # segundos que una entrada se considera vigente
+        self._entradas = OrderedDict()   # clave -> (valor , momento de vencimiento)
+        self._candado = threading.Lock()   # varios hilos de flask comparten el mismo cache
+        self._aciertos = 0
+        self._fallos = 0
+        self._vencidas = 0
+        self._expulsiones = 0
+
+    def obtener(self, clave):
+        # devuelve (valor , vigente) , o (None , False) si la clave no esta en el cache
+        with self._candado:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                self._fallos += 1
+                return None, False
+            self._entradas.move_to_end(clave)   # la marcamos como la mas usada recientemente
+            valor, vence = entrada
+            if time.monotonic() >= vence:
+                self._vencidas += 1
+                return valor, False
+            self._aciertos += 1
+            return valor, True
+
+    def guardar(self, clave, valor, ttl=None):   # guarda un valor , ttl permite usar un tiempo de vida distinto (ej. respuestas negativas)
+        with self._candado:
+            self._entradas[clave] = (valor, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.capacidad:   # si nos pasamos de la capacidad sacamos la menos usada
+                self._entradas.popitem(last=False)
+                self._expulsiones += 1
+
+    def refrescar(self, clave, ttl=None):   # renueva el vencimiento de una entrada que se revalido sin cambios
+        with self._candado:
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                self._entradas[clave] = (entrada[0], time.monotonic() + (self.ttl if ttl is None else ttl))
+
+    def eliminar(self, clave):
+        with self._candado:
+            self._entradas.pop(clave, None)
+
+    def estadisticas(self):   # contadores para ajustar capacidad y ttl
+        with self._candado:
+            consultas = self._aciertos + self._fallos + self._vencidas
+            return {
+                "tamano": len(self._entradas),
+                "capacidad": self.capacidad,
+                "ttl": self.ttl,
+                "aciertos": self._aciertos,
+                "fallos": self._fallos,
+                "vencidas": self._vencidas,
+                "expulsiones": self._expulsiones,
+                "tasa_aciertos": self._aciertos / consultas if consultas else 0.0,
+            }
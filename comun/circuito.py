@@ -0,0 +1,110 @@
+import os, threading, time, logging   # importamos logging para registrar los cambios de estado del circuito
+from collections import deque   # cola de tamano fijo para la ventana de resultados
+
+CERRADO = "cerrado"   # las llamadas pasan normalmente
+ABIERTO = "abierto"   # el servicio se considera caido , las llamadas se rechazan sin intentar
+SEMI_ABIERTO = "semi_abierto"   # paso el enfriamiento , se deja pasar una sola llamada de prueba
+
+
+class CircuitoAbierto(Exception):   # se lanza cuando el circuito rechaza la llamada sin llegar al servicio
+    pass
+
+
+class Circuito:
+    # circuit breaker por servicio dependiente , si la tasa de fallos supera el umbral se abre y responde al instante
+    def __init__(self, nombre, ventana=20, minimo_llamadas=5, umbral_fallos=0.5, enfriamiento=10.0):
+        self.nombre = nombre
+        self.minimo_llamadas = minimo_llamadas   # no se abre con pocas llamadas , evita abrir por un solo fallo
+        self.umbral_fallos = umbral_fallos   # proporcion de fallos en la ventana que abre el circuito
+        self.enfriamiento = enfriamiento   # segundos que el circuito queda abierto antes de probar de nuevo
+        self._resultados = deque(maxlen=ventana)   # True = fallo , False = exito , solo las ultimas llamadas
+        self._estado = CERRADO
+        self._abierto_desde = 0.0
+        self._probando = False   # hay una llamada de prueba en curso (estado semi abierto)
+        self._generacion = 0   # cambia cada vez que el circuito se abre o se cierra , los resultados de generaciones viejas se descartan
+        self._rechazadas = 0
+        self._aperturas = 0
+        self._candado = threading.Lock()   # varios hilos de flask comparten el mismo circuito
+
+    @classmethod
+    def desde_entorno(cls, nombre):   # construye el circuito leyendo la configuracion de variables de entorno , con valores por defecto
+        return cls(
+            nombre,
+            ventana=int(os.environ.get("CIRCUITO_VENTANA", 20)),
+            minimo_llamadas=int(os.environ.get("CIRCUITO_MINIMO_LLAMADAS", 5)),
+            umbral_fallos=float(os.environ.get("CIRCUITO_UMBRAL_FALLOS", 0.5)),
+            enfriamiento=float(os.environ.get("CIRCUITO_ENFRIAMIENTO", 10.0)),
+        )
+
+    def _abrir(self):
+        if self._estado != ABIERTO:
+            self._aperturas += 1
+            logging.error(f"CIRCUITO {self.nombre} ABIERTO: se rechazan las llamadas por {self.enfriamiento} segundos")
+        self._estado = ABIERTO
+        self._abierto_desde = time.monotonic()
+        self._generacion += 1
+
+    def _permitir(self):
+        # decide si la llamada puede pasar , se llama con el candado tomado
+        # devuelve None si se rechaza , o el permiso (generacion , es_prueba) que la llamada entrega despues junto con su resultado
+        if self._estado == CERRADO:
+            return (self._generacion, False)
+        if self._estado == ABIERTO and time.monotonic() - self._abierto_desde >= self.enfriamiento:
+            self._estado = SEMI_ABIERTO   # paso el enfriamiento , probamos con una sola llamada
+        if self._estado == SEMI_ABIERTO and not self._probando:
+            self._probando = True
+            return (self._generacion, True)
+        return None
+
+    def _registrar(self, permiso, fallo):
+        generacion, es_prueba = permiso
+        with self._candado:
+            if generacion != self._generacion:   # la llamada empezo antes de que el circuito se abriera o se cerrara , su resultado ya no cuenta
+                return
+            if es_prueba:   # resultado de la llamada de prueba , la unica que puede sacar al circuito de semi abierto
+                self._probando = False
+                if fallo:
+                    self._abrir()   # sigue caido , volvemos a esperar el enfriamiento
+                else:
+                    self._estado = CERRADO
+                    self._generacion += 1
+                    self._resultados.clear()   # arrancamos con la ventana limpia
+                    logging.info(f"CIRCUITO {self.nombre} CERRADO: el servicio volvio a responder")
+                return
+            self._resultados.append(fallo)
+            fallos = sum(self._resultados)
+            if len(self._resultados) >= self.minimo_llamadas and fallos / len(self._resultados) >= self.umbral_fallos:
+                self._abrir()
+
+    def ejecutar(self, funcion, es_fallo=None):
+        # ejecuta la llamada protegida por el circuito , es_fallo permite contar como fallo una respuesta (ej. un 5xx)
+        with self._candado:
+            permiso = self._permitir()
+            if permiso is None:
+                self._rechazadas += 1
+                raise CircuitoAbierto(self.nombre)
+        try:
+            resultado = funcion()
+        except Exception:   # cualquier error de la llamada cuenta como fallo y se propaga al servicio
+            self._registrar(permiso, True)
+            raise
+        self._registrar(permiso, bool(es_fallo and es_fallo(resultado)))
+        return resultado
+
+    def estado(self):   # devuelve el estado actual del circuito para el endpoint de consulta
+        with self._candado:
+            llamadas = len(self._resultados)
+            fallos = sum(self._resultados)
+            restante = 0.0
+            if self._estado == ABIERTO:
+                restante = max(0.0, self.enfriamiento - (time.monotonic() - self._abierto_desde))
+            return {
+                "nombre": self.nombre,
+                "estado": self._estado,
+                "llamadas_en_ventana": llamadas,
+                "fallos_en_ventana": fallos,
+                "tasa_fallos": fallos / llamadas if llamadas else 0.0,
+                "segundos_para_reintentar": round(restante, 3),
+                "rechazadas": self._rechazadas,
+                "aperturas": self._aperturas,
+            }
@@ -0,0 +1,97 @@
+import os, random, threading, time, logging   # importamos logging para registrar los reintentos
+from urllib.parse import urlsplit   # para sacar el host de cada url y llevar estadisticas por host
+import requests
+from requests.adapters import HTTPAdapter   # adaptador de requests que maneja el pool de conexiones (urllib3)
+from comun import trazas
+from comun.metricas import LLAMADAS_SALIENTES, REINTENTOS_SALIENTES
+
+
+class ClienteHTTP:
+    # cliente http compartido por proceso , reutiliza conexiones keep-alive en vez de abrir una conexion TCP nueva en cada peticion
+    def __init__(self, pool_conexiones=10, pool_maximo=20, timeout_conexion=1.0, timeout_lectura=3.0,
+                 intentos=3, backoff_base=0.1, backoff_maximo=2.0):
+        self.timeout = (timeout_conexion, timeout_lectura)   # requests acepta una tupla (conexion , lectura)
+        self.intentos = intentos   # cantidad total de intentos (el primero mas los reintentos)
+        self.backoff_base = backoff_base   # espera base en segundos , se duplica en cada reintento
+        self.backoff_maximo = backoff_maximo   # tope de la espera entre reintentos
+        self.sesion = requests.Session()   # una sola sesion por proceso , guarda las conexiones abiertas
+        adaptador = HTTPAdapter(pool_connections=pool_conexiones, pool_maxsize=pool_maximo, pool_block=False)   # pool_connections = hosts distintos , pool_maxsize = conexiones por host
+        self.sesion.mount("http://", adaptador)
+        self.sesion.mount("https://", adaptador)
+        self._adaptador = adaptador
+        self._candado = threading.Lock()   # las estadisticas se actualizan desde varios hilos de flask
+        self._estadisticas = {}   # contadores por host
+
+    @classmethod
+    def desde_entorno(cls):   # construye el cliente leyendo la configuracion de variables de entorno , con valores por defecto
+        return cls(
+            pool_conexiones=int(os.environ.get("HTTP_POOL_CONEXIONES", 10)),
+            pool_maximo=int(os.environ.get("HTTP_POOL_MAXIMO", 20)),
+            timeout_conexion=float(os.environ.get("HTTP_TIMEOUT_CONEXION", 1.0)),
+            timeout_lectura=float(os.environ.get("HTTP_TIMEOUT_LECTURA", 3.0)),
+            intentos=int(os.environ.get("HTTP_INTENTOS", 3)),
+            backoff_base=float(os.environ.get("HTTP_BACKOFF_BASE", 0.1)),
+            backoff_maximo=float(os.environ.get("HTTP_BACKOFF_MAXIMO", 2.0)),
+        )
+
+    def _espera(self, intento):   # backoff exponencial con jitter completo , evita que todos los hilos reintenten a la vez
+        return random.uniform(0, min(self.backoff_maximo, self.backoff_base * (2 ** intento)))
+
+    def _registrar(self, host, campo, valor=1):   # suma un valor a un contador del host
+        with self._candado:
+            estadistica = self._estadisticas.setdefault(host, {
+                "peticiones": 0, "respuestas": 0, "errores": 0, "reintentos": 0, "latencia_total_ms": 0.0
+            })
+            estadistica[campo] += valor
+
+    def get(self, url, headers=None, destino=None):
+        # hace un GET con reintentos , si despues de todos los intentos no hay respuesta lanza la ultima excepcion de requests
+        # destino es el nombre del servicio para las metricas y los tiempos por etapa (por defecto el host)
+        host = urlsplit(url).netloc
+        destino = destino or host
+        headers = dict(headers or {})
+        if trazas.id_actual():   # propagamos el id de la peticion al servicio vecino
+            headers[trazas.ENCABEZADO_ID] = trazas.id_actual()
+        for intento in range(self.intentos):
+            self._registrar(host, "peticiones")
+            inicio = time.perf_counter()
+            try:
+                respuesta = self.sesion.get(url, headers=headers, timeout=self.timeout)
+                duracion = time.perf_counter() - inicio
+                self._registrar(host, "respuestas")
+                self._registrar(host, "latencia_total_ms", duracion * 1000)
+                LLAMADAS_SALIENTES.observar(duracion, destino, respuesta.status_code)
+                trazas.sumar_etapa(destino, duracion)
+                return respuesta
+            except requests.exceptions.RequestException:   # error de conexion o timeout , reintentamos
+                duracion = time.perf_counter() - inicio
+                LLAMADAS_SALIENTES.observar(duracion, destino, "error")
+                trazas.sumar_etapa(destino, duracion)
+                self._registrar(host, "errores")
+                logging.warning(f"REINTENTO {intento + 1}: {host} no responde")   # registramos un log de advertencia por cada intento fallido
+                if intento + 1 >= self.intentos:   # ya no quedan intentos , propagamos el error al servicio
+                    raise
+                self._registrar(host, "reintentos")
+                REINTENTOS_SALIENTES.sumar(destino)
+                trazas.sumar_etapa(f"{destino}_reintentos", 1)
+                espera = self._espera(intento)
+                trazas.sumar_etapa(f"{destino}_espera", espera)
+                time.sleep(espera)   # esperamos antes de reintentar , en vez de reintentar de inmediato
+
+    def estadisticas(self):   # devuelve los contadores por host y el estado de los pools de conexiones
+        with self._candado:
+            resultado = {host: dict(valores) for host, valores in self._estadisticas.items()}
+        pools = self._adaptador.poolmanager.pools
+        for clave in list(pools.keys()):
+            pool = pools.get(clave)
+            if pool is None:   # el pool pudo ser descartado entre keys() y get()
+                continue
+            host = f"{clave.key_host}:{clave.key_port}"
+            resultado.setdefault(host, {})["pool"] = {
+                "conexiones_creadas": pool.num_connections,   # conexiones TCP abiertas desde que existe el pool
+                "peticiones_servidas": pool.num_requests,
+                # urllib3 llena la cola con None para reservar lugares , solo contamos las conexiones reales esperando ser reutilizadas
+                "conexiones_libres": sum(conexion is not None for conexion in list(pool.pool.queue)) if pool.pool is not None else 0,
+                "tamano_maximo": self._adaptador._pool_maxsize,
+            }
+        return resultado
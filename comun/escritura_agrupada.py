@@ -0,0 +1,114 @@
+import os, queue, sqlite3, threading, time, logging
+from concurrent.futures import Future   # cada peticion espera su resultado en un Future hasta que su lote se guarde
+from comun import trazas
+
+
+class EscritorAgrupado:
+    # group commit : los INSERT de muchas peticiones se juntan y se guardan en una sola transaccion (un solo fsync)
+    # un hilo en segundo plano vacia la cola cada max_espera_ms milisegundos o cuando junta max_filas filas
+    def __init__(self, pool, max_filas=100, max_espera_ms=2.0):
+        self.pool = pool   # pool de conexiones de comun.almacenamiento
+        self._db = None   # conexion propia del hilo escritor , se abre con la primera escritura
+        self.max_filas = max_filas
+        self.max_espera = max_espera_ms / 1000
+        self._cola = queue.Queue()
+        self._candado = threading.Lock()
+        self._lotes = 0
+        self._filas = 0
+        self._lote_maximo = 0
+        self._latencia_total = 0.0   # segundos sumados de todas las escrituras de lotes
+        self._latencia_maxima = 0.0
+        self._hilo = threading.Thread(target=self._bucle, name="escritor-agrupado", daemon=True)
+        self._hilo.start()
+
+    @classmethod
+    def desde_entorno(cls, pool, variable):
+        # devuelve un escritor solo si la variable de entorno del servicio lo activa (ej. PEDIDOS_COMMIT_AGRUPADO=1) , si no None
+        if os.environ.get(variable) != "1":
+            return None
+        return cls(
+            pool,
+            max_filas=int(os.environ.get("COMMIT_AGRUPADO_MAX_FILAS", 100)),
+            max_espera_ms=float(os.environ.get("COMMIT_AGRUPADO_MAX_ESPERA_MS", 2.0)),
+        )
+
+    def insertar(self, sql, parametros):
+        # encola el INSERT y espera a que su lote este guardado , devuelve el id asignado o lanza el error de sqlite
+        futuro = Future()
+        inicio = time.perf_counter()
+        self._cola.put((sql, parametros, futuro))
+        try:
+            return futuro.result()
+        finally:
+            trazas.sumar_etapa("commit_agrupado", time.perf_counter() - inicio)   # espera en la cola mas la escritura del lote
+
+    def _bucle(self):
+        while True:
+            lote = [self._cola.get()]   # esperamos la primera fila , despues juntamos las que lleguen dentro de la ventana
+            limite = time.monotonic() + self.max_espera
+            while len(lote) < self.max_filas:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    lote.append(self._cola.get(timeout=restante))
+                except queue.Empty:
+                    break
+            try:
+                self._escribir(lote)
+            except Exception as e:   # el hilo nunca debe morir , si no las peticiones quedarian esperando para siempre
+                logging.error(f"Error en la escritura agrupada : {e}")
+                for _, _, futuro in lote:
+                    if not futuro.done():
+                        futuro.set_exception(e)
+
+    def _escribir(self, lote):
+        inicio = time.perf_counter()
+        resultados = []   # (futuro , id o None , error o None)
+        # el hilo usa su propia conexion y no una del pool : las peticiones que esperan su lote pueden tener tomadas
+        # todas las del pool , y si el escritor tambien esperara una nadie avanzaria
+        if self._db is None:
+            self._db = self.pool.conexion_dedicada()
+        db = self._db
+        try:
+            db.execute("BEGIN")
+            for sql, parametros, futuro in lote:
+                db.execute("SAVEPOINT fila")   # si una fila falla solo se deshace esa , el resto del lote se guarda igual
+                try:
+                    cursor = db.execute(sql, parametros)
+                    resultados.append((futuro, cursor.lastrowid, None))
+                except sqlite3.DatabaseError as e:
+                    db.execute("ROLLBACK TO fila")
+                    resultados.append((futuro, None, e))
+                db.execute("RELEASE fila")
+            db.commit()   # un solo commit para todo el lote
+        finally:
+            if db.in_transaction:   # si fallo a mitad del lote no dejamos la transaccion abierta para el proximo
+                db.rollback()
+        duracion = time.perf_counter() - inicio
+        for futuro, id_fila, error in resultados:   # recien ahora que el lote es durable respondemos a cada peticion
+            if error:
+                futuro.set_exception(error)
+            else:
+                futuro.set_result(id_fila)
+        with self._candado:
+            self._lotes += 1
+            self._filas += len(lote)
+            self._lote_maximo = max(self._lote_maximo, len(lote))
+            self._latencia_total += duracion
+            self._latencia_maxima = max(self._latencia_maxima, duracion)
+
+    def estadisticas(self):   # tamano de lote y latencia de escritura , para ajustar max_filas y max_espera_ms
+        with self._candado:
+            return {
+                "activo": True,
+                "lotes": self._lotes,
+                "filas": self._filas,
+                "filas_por_lote": self._filas / self._lotes if self._lotes else 0.0,
+                "lote_maximo": self._lote_maximo,
+                "latencia_escritura_promedio_ms": (self._latencia_total / self._lotes) * 1000 if self._lotes else 0.0,
+                "latencia_escritura_maxima_ms": self._latencia_maxima * 1000,
+                "pendientes": self._cola.qsize(),
+                "max_filas": self.max_filas,
+                "max_espera_ms": self.max_espera * 1000,
+            }
@@ -0,0 +1,168 @@
+import hashlib, logging, os, sqlite3, threading, time
+from concurrent.futures import Future, TimeoutError   # las peticiones repetidas que llegan juntas esperan el resultado de la primera
+from functools import wraps
+from flask import current_app, jsonify, request, Response
+from comun.cache import CacheLRU
+from comun.metricas import REGISTRO
+
+ENCABEZADO = "Idempotency-Key"   # el cliente manda la misma clave en cada reintento de la misma operacion
+LARGO_MAXIMO_CLAVE = 255
+RESULTADOS = REGISTRO.contador("idempotencia_total", "Peticiones con Idempotency-Key por resultado", ("resultado",))
+
+
+class AlmacenIdempotencia:
+    # guarda la respuesta de cada POST con Idempotency-Key , si la clave se repite devuelve la misma respuesta sin volver a ejecutarlo
+    # un cache LRU en memoria delante de una tabla sqlite (sobrevive a reinicios) , las claves vencen despues de ttl segundos
+    def __init__(self, pool, obtener_db, capacidad=10000, ttl=86400.0, espera=30.0, purgar_cada=500):
+        self.pool = pool   # pool de conexiones de comun.almacenamiento
+        self.obtener_db = obtener_db   # devuelve la conexion de la peticion en curso (la de g) , la respuesta se guarda con la misma conexion que uso la vista
+        self.ttl = ttl   # segundos que se recuerda cada clave
+        self.espera = espera   # segundos que una peticion repetida espera a que termine la primera
+        self.purgar_cada = purgar_cada   # cada cuantas respuestas guardadas se borran las claves vencidas de la tabla
+        self._cache = CacheLRU(capacidad=capacidad, ttl=ttl)
+        self._en_curso = {}   # clave -> Future de la peticion que la esta ejecutando
+        self._candado = threading.Lock()
+        self._contadores = {"aciertos_memoria": 0, "aciertos_db": 0, "coalescidas": 0, "nuevas": 0, "conflictos": 0, "errores_guardado": 0}
+        self._guardadas = 0
+
+    @classmethod
+    def desde_entorno(cls, pool, obtener_db):   # construye el almacen leyendo la configuracion de variables de entorno , con valores por defecto
+        return cls(
+            pool,
+            obtener_db,
+            capacidad=int(os.environ.get("IDEMPOTENCIA_CAPACIDAD", 10000)),
+            ttl=float(os.environ.get("IDEMPOTENCIA_TTL", 86400.0)),
+            espera=float(os.environ.get("IDEMPOTENCIA_ESPERA", 30.0)),
+        )
+
+    def inicializar_db(self, db):
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS idempotencia (
+                clave TEXT PRIMARY KEY,
+                huella TEXT NOT NULL,
+                estado INTEGER NOT NULL,
+                cuerpo BLOB NOT NULL,
+                tipo TEXT NOT NULL,
+                vence REAL NOT NULL
+            ) WITHOUT ROWID
+        """)  # sin rowid la fila se guarda dentro del indice de la clave , una sola busqueda por consulta
+        db.execute("CREATE INDEX IF NOT EXISTS idx_idempotencia_vence ON idempotencia (vence)")  # para purgar las vencidas sin recorrer la tabla
+        db.commit()
+
+    def _contar(self, resultado):
+        with self._candado:
+            self._contadores[resultado] += 1
+        RESULTADOS.sumar(resultado)
+
+    def _buscar(self, clave):
+        # devuelve (respuesta guardada , origen) , primero en memoria y despues en sqlite , o (None , None) si la clave es nueva o vencio
+        # la conexion se devuelve enseguida : la vista todavia no empezo y no hace falta retenerla durante las llamadas a otros servicios
+        guardada, vigente = self._cache.obtener(clave)
+        if vigente:
+            return guardada, "aciertos_memoria"
+        with self.pool.conexion() as db:
+            fila = db.execute(
+                "SELECT huella, estado, cuerpo, tipo, vence FROM idempotencia WHERE clave = ? AND vence > ?", (clave, time.time())
+            ).fetchone()
+        if fila is None:
+            return None, None
+        guardada = {"huella": fila["huella"], "estado": fila["estado"], "cuerpo": fila["cuerpo"], "tipo": fila["tipo"]}
+        self._cache.guardar(clave, guardada, ttl=fila["vence"] - time.time())   # en memoria vence junto con la fila
+        return guardada, "aciertos_db"
+
+    def _guardar(self, clave, guardada):
+        self._cache.guardar(clave, guardada)   # primero en memoria , si sqlite falla los reintentos a este proceso siguen protegidos
+        with self._candado:
+            self._guardadas += 1
+            purgar = self._guardadas % self.purgar_cada == 0
+        # con la conexion de la peticion : si pidieramos otra al pool mientras la vista retiene la suya , con el pool lleno no llegaria nunca
+        db = self.obtener_db()
+        try:
+            db.execute(
+                "INSERT OR REPLACE INTO idempotencia (clave, huella, estado, cuerpo, tipo, vence) VALUES (?, ?, ?, ?, ?, ?)",
+                (clave, guardada["huella"], guardada["estado"], guardada["cuerpo"], guardada["tipo"], time.time() + self.ttl)
+            )
+            if purgar:
+                db.execute("DELETE FROM idempotencia WHERE vence <= ?", (time.time(),))
+            db.commit()
+        except sqlite3.DatabaseError:
+            if db.in_transaction:
+                db.rollback()
+            raise
+
+    def _repetir(self, guardada, huella, origen):
+        # devuelve la respuesta original , salvo que la clave se haya usado con otro cuerpo (eso no cuenta como repeticion)
+        if guardada["huella"] != huella:
+            self._contar("conflictos")
+            return jsonify({"error": f"La {ENCABEZADO} ya se uso con otro cuerpo"}), 422
+        self._contar(origen)
+        return Response(guardada["cuerpo"], status=guardada["estado"], mimetype=guardada["tipo"], headers={"Idempotent-Replayed": "true"})
+
+    def idempotente(self, vista):
+        # decorador para los POST , va debajo de requiere_autenticacion , sin el encabezado la vista se ejecuta como siempre
+        @wraps(vista)
+        def envoltorio(*args, **kwargs):
+            valor = request.headers.get(ENCABEZADO)
+            if valor is None:
+                return vista(*args, **kwargs)
+            if not valor or len(valor) > LARGO_MAXIMO_CLAVE:
+                return jsonify({"error": f"{ENCABEZADO} debe tener entre 1 y {LARGO_MAXIMO_CLAVE} caracteres"}), 400
+            clave = f"{request.method} {request.path} {valor}"   # la misma clave en otro endpoint es otra operacion
+            huella = hashlib.sha256(request.get_data()).hexdigest()   # para detectar la misma clave con otro cuerpo
+
+            while True:
+                guardada, origen = self._buscar(clave)
+                if guardada is not None:   # repeticion de una peticion ya terminada , no se llama a otros servicios ni se escribe
+                    return self._repetir(guardada, huella, origen)
+                with self._candado:
+                    futuro = self._en_curso.get(clave)
+                    if futuro is None:   # somos la primera , las repetidas que lleguen mientras tanto esperan este Future
+                        futuro = self._en_curso[clave] = Future()
+                        break
+                try:
+                    guardada = futuro.result(timeout=self.espera)
+                except TimeoutError:
+                    return jsonify({"error": f"Hay una peticion con la misma {ENCABEZADO} en curso , intente mas tarde"}), 409
+                if guardada is not None:
+                    return self._repetir(guardada, huella, "coalescidas")
+                # la primera no dejo respuesta guardada (error 5xx) , volvemos a empezar como si fuera una peticion nueva
+
+            guardada = None
+            try:
+                guardada, origen = self._buscar(clave)   # pudo terminar otra entre nuestra busqueda y el registro en _en_curso
+                if guardada is not None:
+                    return self._repetir(guardada, huella, origen)
+                self._contar("nuevas")
+                respuesta = current_app.make_response(vista(*args, **kwargs))
+                if respuesta.status_code < 500:   # los 5xx son fallas transitorias , el reintento tiene que volver a ejecutarse
+                    guardada = {"huella": huella, "estado": respuesta.status_code, "cuerpo": respuesta.get_data(), "tipo": respuesta.mimetype}
+                    try:
+                        self._guardar(clave, guardada)
+                    except sqlite3.DatabaseError as e:   # la operacion ya se hizo , la respuesta queda solo en memoria (no sobrevive a un reinicio)
+                        self._contar("errores_guardado")
+                        logging.error(f"Error al guardar la {ENCABEZADO} en la base , queda solo en memoria : {e}")
+                return respuesta
+            finally:
+                with self._candado:
+                    self._en_curso.pop(clave, None)
+                futuro.set_result(guardada)   # despierta a las repetidas , con la respuesta o con None para que reintenten
+        return envoltorio
+
+    def estadisticas(self):   # aciertos en memoria y en sqlite , tamano de ambos , para dimensionar IDEMPOTENCIA_CAPACIDAD
+        with self.pool.conexion() as db:
+            filas = db.execute("SELECT COUNT(*) FROM idempotencia WHERE vence > ?", (time.time(),)).fetchone()[0]
+        with self._candado:
+            contadores = dict(self._contadores)
+            en_curso = len(self._en_curso)
+        aciertos = contadores["aciertos_memoria"] + contadores["aciertos_db"]
+        repetidas = aciertos + contadores["coalescidas"]
+        total = repetidas + contadores["nuevas"] + contadores["conflictos"]
+        return {
+            **contadores,
+            "en_curso": en_curso,
+            "tasa_repeticiones": repetidas / total if total else 0.0,
+            "tasa_aciertos_memoria": contadores["aciertos_memoria"] / aciertos if aciertos else 0.0,
+            "filas_db": filas,
+            "ttl": self.ttl,
+            "cache": self._cache.estadisticas(),   # tamano , capacidad y expulsiones del LRU
+        }
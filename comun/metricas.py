@@ -0,0 +1,132 @@
+import bisect, logging, threading, time
+from flask import g, request, Response
+from comun import trazas
+
+CUBETAS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)   # limites en segundos de los histogramas
+
+
+def _etiquetas(nombres, valores):   # arma {a="1",b="2"} escapando los valores como pide el formato de prometheus
+    partes = []
+    for nombre, valor in zip(nombres, valores):
+        valor = str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        partes.append(f'{nombre}="{valor}"')
+    return ",".join(partes)
+
+
+class Contador:
+    def __init__(self, nombre, ayuda, etiquetas):
+        self.nombre, self.ayuda, self.etiquetas = nombre, ayuda, etiquetas
+        self._valores = {}
+        self._candado = threading.Lock()
+
+    def sumar(self, *valores_etiquetas, cantidad=1):
+        with self._candado:
+            self._valores[valores_etiquetas] = self._valores.get(valores_etiquetas, 0) + cantidad
+
+    def texto(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        with self._candado:
+            for valores, total in sorted(self._valores.items()):
+                lineas.append(f"{self.nombre}{{{_etiquetas(self.etiquetas, valores)}}} {total}")
+        return lineas
+
+
+class Histograma:
+    def __init__(self, nombre, ayuda, etiquetas, cubetas=CUBETAS):
+        self.nombre, self.ayuda, self.etiquetas, self.cubetas = nombre, ayuda, etiquetas, cubetas
+        self._series = {}   # etiquetas -> [conteo por cubeta (la ultima es +Inf) , suma , cantidad]
+        self._candado = threading.Lock()
+
+    def observar(self, segundos, *valores_etiquetas):
+        indice = bisect.bisect_left(self.cubetas, segundos)   # primera cubeta cuyo limite es >= al valor
+        with self._candado:
+            serie = self._series.get(valores_etiquetas)
+            if serie is None:
+                serie = self._series[valores_etiquetas] = [[0] * (len(self.cubetas) + 1), 0.0, 0]
+            serie[0][indice] += 1
+            serie[1] += segundos
+            serie[2] += 1
+
+    def texto(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        with self._candado:
+            for valores, (conteos, suma, cantidad) in sorted(self._series.items()):
+                etiquetas = _etiquetas(self.etiquetas, valores)
+                separador = "," if etiquetas else ""
+                acumulado = 0
+                for limite, conteo in zip(self.cubetas + ("+Inf",), conteos):   # en prometheus las cubetas son acumulativas
+                    acumulado += conteo
+                    lineas.append(f'{self.nombre}_bucket{{{etiquetas}{separador}le="{limite}"}} {acumulado}')
+                lineas.append(f"{self.nombre}_sum{{{etiquetas}}} {suma}")
+                lineas.append(f"{self.nombre}_count{{{etiquetas}}} {cantidad}")
+        return lineas
+
+
+class RegistroMetricas:   # todas las metricas del proceso , se exponen juntas en /metrics
+    def __init__(self):
+        self._metricas = []
+
+    def contador(self, nombre, ayuda, etiquetas=()):
+        metrica = Contador(nombre, ayuda, etiquetas)
+        self._metricas.append(metrica)
+        return metrica
+
+    def histograma(self, nombre, ayuda, etiquetas=()):
+        metrica = Histograma(nombre, ayuda, etiquetas)
+        self._metricas.append(metrica)
+        return metrica
+
+    def texto(self):   # formato de texto de prometheus
+        lineas = []
+        for metrica in self._metricas:
+            lineas.extend(metrica.texto())
+        return "\n".join(lineas) + "\n"
+
+
+REGISTRO = RegistroMetricas()   # un registro por proceso , lo comparten el cliente http , el pool de sqlite y las rutas
+PETICIONES = REGISTRO.contador("peticiones_total", "Peticiones atendidas", ("ruta", "metodo", "estado"))
+DURACION_PETICIONES = REGISTRO.histograma("peticion_duracion_segundos", "Duracion de las peticiones atendidas", ("ruta", "metodo", "estado"))
+LLAMADAS_SALIENTES = REGISTRO.histograma("llamada_saliente_duracion_segundos", "Duracion de cada intento de llamada a otro servicio", ("destino", "resultado"))
+REINTENTOS_SALIENTES = REGISTRO.contador("reintentos_salientes_total", "Reintentos de llamadas a otros servicios", ("destino",))
+OPERACIONES_DB = REGISTRO.histograma("db_operacion_duracion_segundos", "Duracion de las consultas y commits de sqlite", ("operacion",))
+
+
+def instrumentar(app, proteger=None):
+    # agrega a la app flask : id de peticion (X-Request-ID) , tiempos por etapa , metricas por ruta y el endpoint /metrics
+    # proteger es el decorador de autenticacion del servicio , /metrics queda detras del mismo token que el resto
+
+    @app.before_request
+    def _iniciar():
+        g.tokens_traza = trazas.iniciar_peticion(request.headers.get(trazas.ENCABEZADO_ID))
+        g.inicio_peticion = time.perf_counter()
+
+    @app.after_request
+    def _registrar(respuesta):
+        inicio = g.get("inicio_peticion")
+        if inicio is None:
+            return respuesta
+        duracion = time.perf_counter() - inicio
+        ruta = request.url_rule.rule if request.url_rule else "sin_ruta"   # la regla y no la url , para no crear una serie por cada id
+        PETICIONES.sumar(ruta, request.method, respuesta.status_code)
+        DURACION_PETICIONES.observar(duracion, ruta, request.method, respuesta.status_code)
+        etapas = trazas.etapas_actuales()
+        respuesta.headers[trazas.ENCABEZADO_ID] = trazas.id_actual()
+        respuesta.headers["Server-Timing"] = ", ".join(   # el cliente ve en que se fue el tiempo de la peticion
+            [f"{nombre};dur={valor * 1000:.2f}" for nombre, valor in etapas.items() if isinstance(valor, float)]
+            + [f"total;dur={duracion * 1000:.2f}"]
+        )
+        detalle = " ".join(
+            f"{nombre}={valor}" if isinstance(valor, int) else f"{nombre}_ms={valor * 1000:.2f}" for nombre, valor in etapas.items()
+        )
+        logging.info(f"PETICION metodo={request.method} ruta={ruta} estado={respuesta.status_code} total_ms={duracion * 1000:.2f} {detalle}".rstrip())
+        return respuesta
+
+    @app.teardown_request
+    def _terminar(exception):
+        tokens = g.pop("tokens_traza", None)
+        if tokens:
+            trazas.terminar_peticion(tokens)
+
+    def metricas():
+        return Response(REGISTRO.texto(), mimetype="text/plain; version=0.0.4")
+    app.add_url_rule("/metrics", "metricas", proteger(metricas) if proteger else metricas, methods=["GET"])
@@ -0,0 +1,156 @@
+import asyncio, io, json, os, sys, threading
+from concurrent.futures import ThreadPoolExecutor   # pool chico de hilos donde corre el codigo bloqueante (flask , sqlite , requests)
+
+
+class AdaptadorASGI:
+    # sirve una app flask (WSGI) desde un servidor asyncio (ASGI , ej. uvicorn) con concurrencia acotada
+    # las conexiones las atiende el event loop , una peticion ocupa un hilo desde que empieza la vista hasta que termina (incluidas las esperas a otros servicios)
+    # si hay demasiadas peticiones esperando se responde 429 en vez de acumularlas sin limite
+    def __init__(self, app, concurrencia=8, maximo_en_cola=64, al_iniciar=None):
+        self.app = app
+        self.concurrencia = concurrencia   # peticiones ejecutandose a la vez (= hilos del pool)
+        self.maximo_en_cola = maximo_en_cola   # peticiones esperando turno , arriba de esto se rechazan con 429
+        self.al_iniciar = al_iniciar   # funcion que se ejecuta al arrancar el servidor (ej. inicializar la base)
+        self._hilos = ThreadPoolExecutor(max_workers=concurrencia, thread_name_prefix="asgi")
+        self._semaforo = None   # se crea dentro del event loop
+        self._en_cola = 0
+        self._en_curso = 0
+        self._rechazadas = 0
+        self._activo = False   # pasa a True cuando un servidor ASGI empieza a usar el adaptador
+        self._candado = threading.Lock()
+
+    @classmethod
+    def desde_entorno(cls, app, al_iniciar=None):   # construye el adaptador leyendo la configuracion de variables de entorno , con valores por defecto
+        return cls(
+            app,
+            # por defecto tantos hilos como conexiones tiene el pool de sqlite , si hubiera mas hilos esperarian una conexion
+            concurrencia=int(os.environ.get("ASYNC_CONCURRENCIA", os.environ.get("SQLITE_POOL_TAMANO", 8))),
+            maximo_en_cola=int(os.environ.get("ASYNC_MAXIMO_EN_COLA", 64)),
+            al_iniciar=al_iniciar,
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._ciclo_de_vida(receive, send)
+        elif scope["type"] == "http":
+            await self._atender(scope, receive, send)
+
+    async def _ciclo_de_vida(self, receive, send):   # eventos de arranque y apagado del servidor
+        while True:
+            mensaje = await receive()
+            if mensaje["type"] == "lifespan.startup":
+                self._activo = True
+                if self.al_iniciar:
+                    try:
+                        await asyncio.get_running_loop().run_in_executor(self._hilos, self.al_iniciar)
+                    except Exception as e:   # el servidor no arranca y muestra el error , en vez de atender peticiones sin base inicializada
+                        await send({"type": "lifespan.startup.failed", "message": str(e)})
+                        return
+                await send({"type": "lifespan.startup.complete"})
+            elif mensaje["type"] == "lifespan.shutdown":
+                self._hilos.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _atender(self, scope, receive, send):
+        if self._semaforo is None:
+            self._semaforo = asyncio.Semaphore(self.concurrencia)
+            self._activo = True
+        if self._en_cola >= self.maximo_en_cola:   # la cola esta llena , rechazamos sin ocupar un hilo
+            with self._candado:
+                self._rechazadas += 1
+            await self._enviar(send, 429, [(b"content-type", b"application/json"), (b"retry-after", b"1")],
+                               json.dumps({"error": "Servicio saturado , intente mas tarde"}).encode())
+            return
+
+        self._en_cola += 1   # el contador de cola solo se toca desde el event loop
+        try:
+            cuerpo = await self._leer_cuerpo(receive)
+            await self._semaforo.acquire()
+        finally:
+            self._en_cola -= 1
+        try:
+            with self._candado:
+                self._en_curso += 1
+            estado, encabezados, respuesta = await asyncio.get_running_loop().run_in_executor(
+                self._hilos, self._ejecutar_wsgi, self._armar_environ(scope, cuerpo)
+            )
+        finally:
+            with self._candado:
+                self._en_curso -= 1
+            self._semaforo.release()
+        await self._enviar(send, estado, encabezados, respuesta)
+
+    async def _leer_cuerpo(self, receive):
+        partes = []
+        while True:
+            mensaje = await receive()
+            partes.append(mensaje.get("body", b""))
+            if not mensaje.get("more_body"):
+                return b"".join(partes)
+
+    async def _enviar(self, send, estado, encabezados, cuerpo):
+        await send({"type": "http.response.start", "status": estado, "headers": encabezados})
+        await send({"type": "http.response.body", "body": cuerpo})
+
+    def _armar_environ(self, scope, cuerpo):   # traduce la peticion ASGI al diccionario environ de WSGI
+        servidor = scope.get("server") or ("127.0.0.1", 80)
+        cliente = scope.get("client") or ("127.0.0.1", 0)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", ""),
+            "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),   # WSGI espera los bytes de la ruta como latin-1
+            "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+            "SERVER_NAME": servidor[0],
+            "SERVER_PORT": str(servidor[1]),
+            "REMOTE_ADDR": cliente[0],
+            "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+            "CONTENT_LENGTH": str(len(cuerpo)),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": io.BytesIO(cuerpo),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for nombre, valor in scope.get("headers", []):
+            nombre = nombre.decode("latin-1").upper().replace("-", "_")
+            valor = valor.decode("latin-1")
+            if nombre == "CONTENT_TYPE":
+                environ["CONTENT_TYPE"] = valor
+            elif nombre != "CONTENT_LENGTH":
+                clave = f"HTTP_{nombre}"
+                environ[clave] = f"{environ[clave]},{valor}" if clave in environ else valor   # encabezados repetidos se unen con coma
+        return environ
+
+    def _ejecutar_wsgi(self, environ):   # corre la app flask en un hilo del pool y junta la respuesta completa
+        respuesta = {}
+        cuerpo = []
+
+        def start_response(estado, encabezados, exc_info=None):
+            respuesta["estado"] = int(estado.split(" ", 1)[0])
+            respuesta["encabezados"] = [(nombre.lower().encode("latin-1"), valor.encode("latin-1")) for nombre, valor in encabezados]
+            return cuerpo.append
+
+        resultado = self.app(environ, start_response)
+        try:
+            for parte in resultado:
+                cuerpo.append(parte)
+        finally:
+            if hasattr(resultado, "close"):
+                resultado.close()
+        return respuesta["estado"], respuesta["encabezados"], b"".join(cuerpo)
+
+    def estadisticas(self):   # cola , peticiones en curso y rechazos con 429 , para ajustar ASYNC_CONCURRENCIA y ASYNC_MAXIMO_EN_COLA
+        if not self._activo:   # la app se esta sirviendo con el servidor de flask
+            return {"activo": False}
+        with self._candado:
+            return {
+                "activo": True,
+                "concurrencia": self.concurrencia,
+                "maximo_en_cola": self.maximo_en_cola,
+                "en_curso": self._en_curso,
+                "en_cola": self._en_cola,
+                "rechazadas": self._rechazadas,
+            }
@@ -0,0 +1,42 @@
+import contextvars, logging, uuid   # contextvars guarda datos de la peticion en curso , sin pasarlos por parametro
+
+ENCABEZADO_ID = "X-Request-ID"   # encabezado con el id de la peticion , se genera en el primer servicio y se propaga a los demas
+FORMATO_LOG = "%(asctime)s nivel=%(levelname)s servicio=%(servicio)s request_id=%(request_id)s %(message)s"   # lineas clave=valor
+
+_id_peticion = contextvars.ContextVar("id_peticion", default=None)
+_etapas = contextvars.ContextVar("etapas", default=None)   # tiempos por etapa de la peticion en curso (ej. productos , db)
+
+
+def iniciar_peticion(id_recibido=None):   # se llama al empezar la peticion , usa el id que vino en el encabezado o genera uno
+    return (_id_peticion.set(id_recibido or uuid.uuid4().hex), _etapas.set({}))
+
+def terminar_peticion(tokens):   # se llama al terminar , deja el contexto como estaba (los hilos se reutilizan)
+    _id_peticion.reset(tokens[0])
+    _etapas.reset(tokens[1])
+
+def id_actual():
+    return _id_peticion.get()
+
+def sumar_etapa(nombre, valor):   # suma segundos (o una cantidad , ej. reintentos) a una etapa de la peticion en curso
+    etapas = _etapas.get()
+    if etapas is not None:   # fuera de una peticion (hilos en segundo plano) no hay nada que sumar
+        etapas[nombre] = etapas.get(nombre, 0) + valor
+
+def etapas_actuales():
+    return _etapas.get() or {}
+
+
+class FiltroTrazas(logging.Filter):   # agrega el servicio y el id de la peticion a cada linea de log
+    def __init__(self, servicio):
+        super().__init__()
+        self.servicio = servicio
+
+    def filter(self, registro):
+        registro.servicio = self.servicio
+        registro.request_id = _id_peticion.get() or "-"
+        return True
+
+def configurar_logging(servicio, nivel=logging.INFO):   # reemplaza al logging.basicConfig de cada servicio
+    logging.basicConfig(level=nivel, format=FORMATO_LOG)
+    for manejador in logging.getLogger().handlers:
+        manejador.addFilter(FiltroTrazas(servicio))
@@ -1,38 +1,68 @@
 from flask import Flask, request, jsonify, g   #importamos g para manejar la conexion a la base de datos , guarda datos durante la peticion
 import sqlite3, requests , logging    # importamos logging para registrar eventos importantes
 from functools import wraps    # decoradores para que flask no pierda informacion de la funcion original
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # agregamos la carpeta raiz del proyecto para poder importar el paquete comun
+from comun.cliente_http import ClienteHTTP  # cliente http compartido con pool de conexiones y reintentos con backoff
+from comun.almacenamiento import PoolConexiones, PoolAgotado  # pool de conexiones sqlite con WAL y pragmas ajustados
+from comun.circuito import Circuito, CircuitoAbierto  # circuit breaker para no esperar timeouts cuando el servicio vecino esta caido
+from comun.escritura_agrupada import EscritorAgrupado  # commit agrupado de los INSERT (opcional)
+from comun.servidor_async import AdaptadorASGI  # modo de servicio asyncio (ASGI) con concurrencia acotada
+from comun.metricas import instrumentar  # endpoint /metrics , metricas por ruta y tiempos por etapa
+from comun.idempotencia import AlmacenIdempotencia  # respuestas guardadas por Idempotency-Key , los reintentos no duplican
+from comun.trazas import configurar_logging  # logs con el servicio y el id de la peticion (X-Request-ID)
+from replica import ReplicaPedidos  # replica local de los pedidos , alimentada por el feed de cambios de pedidos
 
 
 app = Flask(__name__)   # creamos la aplicacion flask
-BASE_DE_DATOS = 'pagos.db'  # nombre de la base de datos
+PUERTO = int(os.environ.get("PAGOS_PUERTO", 5002))  # puerto del servicio
+BASE_DE_DATOS = os.environ.get("PAGOS_DB", 'pagos.db')  # nombre de la base de datos
 TOKEN_SECRETO = "mi_token_secreto"  # token secreto para la autenticacion
-URL_SERVICIO_PEDIDOS = "http://127.0.0.1:5001/pedidos"  # URL del MICROservicio de pedidos
+URL_SERVICIO_PEDIDOS = os.environ.get("URL_SERVICIO_PEDIDOS", "http://127.0.0.1:5001/pedidos")  # URL del MICROservicio de pedidos
+MAXIMO_LOTE = 500  # cantidad maxima de pagos en un lote
 
-logging.basicConfig(level=logging.INFO) # configuramos el nivel de logging ,(INFO muestra informacion general del funcionamiento(WARNING, ERROR , CRITICAL))
+configurar_logging("pagos") # configuramos el nivel de logging ,(INFO muestra informacion general del funcionamiento(WARNING, ERROR , CRITICAL))
+pool_db = PoolConexiones.desde_entorno(BASE_DE_DATOS)  # conexiones reutilizables a la base de datos , compartidas por todas las peticiones del proceso
+escritor_agrupado = EscritorAgrupado.desde_entorno(pool_db, "PAGOS_COMMIT_AGRUPADO")  # None si el commit agrupado no esta activado
+cliente_http = ClienteHTTP.desde_entorno()  # un solo cliente por proceso , reutiliza las conexiones al servicio de pedidos
+circuito_pedidos = Circuito.desde_entorno("pedidos")  # circuito del servicio de pedidos , si esta caido respondemos 503 al instante
+replica_pedidos = None if os.environ.get("PAGOS_REPLICA") == "0" else ReplicaPedidos(  # se desactiva con PAGOS_REPLICA=0
+    pool_db, cliente_http, f"{URL_SERVICIO_PEDIDOS}/cambios", TOKEN_SECRETO,
+    intervalo=float(os.environ.get("REPLICA_INTERVALO", 1.0))
+)
 
 def obtener_db():
     if 'db' not in g:    # si no hay conexion a la base de datos en g
-        g.db = sqlite3.connect(BASE_DE_DATOS)  # creamos la conexion a la base de datos , y lo guardamos en g , asi mantenemos una sola conexion por peticion
-        g.db.row_factory = sqlite3.Row   # para que las filas devueltas por las consultas sean accesibles como diccionarios , ya que por defecto son tuplas , ya no [0] , sino ['nombre_columna']
+        g.db = pool_db.obtener()  # tomamos una conexion del pool , y la guardamos en g , asi mantenemos una sola conexion por peticion
     return g.db
 
-def inicializar_db():
-    db = sqlite3.connect(BASE_DE_DATOS)  # funcion para inicializar la base de datos si no existe , con las columnas necesarias
-    db.execute("""
-        CREATE TABLE IF NOT EXISTS pagos (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            id_pedido INTEGER NOT NULL,
-            estado TEXT NOT NULL
-        )
-    """)
-    db.commit()  # guardamos los cambios
-    db.close()  # cerramos la conexion a la base de datos
+idempotencia = AlmacenIdempotencia.desde_entorno(pool_db, obtener_db)  # respuestas de POST /pagos por Idempotency-Key , se guardan con la conexion de la peticion
+
+def inicializar_db():   # funcion para inicializar la base de datos si no existe , con las columnas necesarias
+    with pool_db.conexion() as db:  # tomamos una conexion del pool , al abrirla ya deja la base en modo WAL
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS pagos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                id_pedido INTEGER NOT NULL,
+                estado TEXT NOT NULL
+            )
+        """)
+        db.execute("CREATE INDEX IF NOT EXISTS idx_pagos_id_pedido ON pagos (id_pedido)")  # para GET /pagos?id_pedido= sin recorrer toda la tabla
+        db.commit()  # guardamos los cambios
+        idempotencia.inicializar_db(db)  # tabla de respuestas por Idempotency-Key
+        if replica_pedidos:  # tablas de la replica local de pedidos
+            replica_pedidos.inicializar_db(db)
 
-@app.teardown_appcontext   # decorador de flask que pase lo que pase al finalizar de la peticion cierra la conexion a la base de datos
-def cerrar_db(exception):   # flask cierra la conexion a la base de datos al finalizar la peticion
+@app.teardown_appcontext   # decorador de flask que pase lo que pase al finalizar de la peticion devuelve la conexion al pool
+def cerrar_db(exception):   # flask devuelve la conexion al pool al finalizar la peticion
     db = g.pop('db', None)  # sacamos la conexion a la base de datos si existe en g , si no existe devuelve None
     if db:                   # si existe la conexion a la base de datos
-        db.close()           # cerramos la conexion a la base de datos
+        pool_db.devolver(db)           # la devolvemos al pool para la proxima peticion , sin cerrarla
+
+@app.errorhandler(PoolAgotado)  # no hubo conexion libre a tiempo , respondemos 503 para que el cliente reintente en vez de un 500
+def base_saturada(error):
+    logging.warning(f"POOL AGOTADO: {error}")
+    return jsonify({"error": "Servicio saturado , intente mas tarde"}), 503, {"Retry-After": "1"}
 
 def requiere_autenticacion(funcion):
     @wraps(funcion)
@@ -44,6 +74,8 @@ def requiere_autenticacion(funcion):
         return funcion(*args, **kwargs)
     return envoltorio
 
+instrumentar(app, requiere_autenticacion)  # /metrics queda protegido con el mismo token que el resto de los endpoints
+
 def manejar_respuesta_pedido(respuesta): # maneja errores del servicio de pedidos
     status = respuesta.status_code # obtenemos el codigo de estado de la respuesta
     if status == 200:   #si todo esta bien no hay error
@@ -59,8 +91,40 @@ def manejar_respuesta_pedido(respuesta): # maneja errores del servicio de pedido
     
     return jsonify({"error": "Error desconocido al consultar pedidos"}), 502  # si hay otro error desconocido devolvemos error 502 al cliente del servicio de pagos
 
+def pedidos_replicados(ids_pedidos):  # cuales de los pedidos ya estan en la replica local
+    # usa una conexion que se devuelve enseguida , no la de g : si no la peticion la retendria durante la llamada a pedidos
+    # y durante la espera del commit agrupado , y con el pool lleno el hilo escritor no conseguiria conexion
+    if replica_pedidos is None:
+        return set()
+    with pool_db.conexion() as db:
+        return replica_pedidos.existentes(db, ids_pedidos)
+
+def verificar_pedido(id_pedido): # verifica que el pedido exista , primero en la replica local y si no en el servicio de pedidos
+    if pedidos_replicados([id_pedido]):  # el pedido ya esta replicado , no hace falta consultar pedidos
+        return None
+
+    try:  # intentamos hacer la peticion al servicio de pedidos a traves del circuito , el cliente reintenta con backoff si no responde
+        respuesta = circuito_pedidos.ejecutar(
+            lambda: cliente_http.get(
+                f"{URL_SERVICIO_PEDIDOS}/{id_pedido}",
+                headers={"Authorization": f"Bearer {TOKEN_SECRETO}"},
+                destino="pedidos"
+            ),
+            es_fallo=lambda r: r.status_code >= 500  # un error 5xx de pedidos tambien cuenta como fallo del servicio
+        )
+    except CircuitoAbierto:  # el circuito esta abierto , no intentamos la conexion
+        logging.warning(f"CIRCUITO ABIERTO: pago del pedido {id_pedido} rechazado sin consultar pedidos")
+        return jsonify({"error": "No se pudo verificar el pedido (circuito abierto hacia pedidos)"}), 503  # devolvemos error 503 al instante
+    except requests.exceptions.RequestException:  # si no se obtuvo respuesta del servicio de pedidos despues de los reintentos
+        logging.error(f"Fallo Critico: Servicio de pedidos caido al procesar pago para pedido {id_pedido}")  # registramos un log de error critico , de que el servicio de pedidos esta caido
+        return jsonify({"error": "No se pudo verificar el pedido (Servicio pedidos caido o no responde)"}), 503  # devolvemos error 503 al cliente , por que el servicio de pedidos no esta disponible o cayo 
+    
+    #manejamos los errores que pueden venir del servicio de pedidos
+    return manejar_respuesta_pedido(respuesta)
+
 @app.route("/pagos", methods=["POST"])  # creamos un endpoint para procesar los pagos 
 @requiere_autenticacion  # [pasa primero por la autenticacion]
+@idempotencia.idempotente  # si la Idempotency-Key ya se uso devolvemos la respuesta original sin consultar pedidos ni guardar otro pago
 def procesar_pago():   # funcion para procesar el pago de un pedido
     datos = request.get_json()     # obtenemos los datos enviados en la peticion
     # verificamos si llega la informacion necesaria , para procesar el pago
@@ -72,39 +136,153 @@ def procesar_pago():   # funcion para procesar el pago de un pedido
     except (ValueError, TypeError):  # si no se puede convertir a entero devolvemos error 400
         return jsonify({"error": "id_pedido debe ser un numero entero"}), 400
     
-    respuesta = None  # bandera para saber si se obtuvo respuesta del servicio de pedidos
-    for intento in range(3):  # un retry de 3 intentos para comunicarse con el servicio de pedidos
-        try:  # intentamos hacer la peticion al servicio de pedidos
-            respuesta = requests.get(
-                f"{URL_SERVICIO_PEDIDOS}/{id_pedido}",
-                headers={"Authorization": f"Bearer {TOKEN_SECRETO}"},
-                timeout = 3
-            )
-            break
-        except requests.exceptions.RequestException:   # si hay un error en la peticion , esperamos un poco y reintentamos
-            logging.warning(f"REINTENTO PAGO {intento + 1}: No se pudo verificar pedido {id_pedido}")   # registramos un log de advertencia , de que no se pudo comunicar con el servicio de pedidos
-    
-    if respuesta is None:  # si no se obtuvo respuesta del servicio de pedidos despues de los reintentos
-        logging.error(f"Fallo Critico: Servicio de pedidos caido al procesar pago para pedido {id_pedido}")  # registramos un log de error critico , de que el servicio de pedidos esta caido
-        return jsonify({"error": "No se pudo verificar el pedido (Servicio pedidos caido o no responde)"}), 503  # devolvemos error 503 al cliente , por que el servicio de pedidos no esta disponible o cayo 
-    
-    #manejamos los errores que pueden venir del servicio de pedidos
-    error = manejar_respuesta_pedido(respuesta)
+    # verificamos el pedido en la replica local o en el servicio de pedidos
+    error = verificar_pedido(id_pedido)
     if error: # si hay un error , lo devolvemos al cliente
         return error
 
+    try:  # guardamos el pago en la base de datos
+        if escritor_agrupado:  # con commit agrupado el INSERT se guarda junto con los de otras peticiones
+            id_pago = escritor_agrupado.insertar("INSERT INTO pagos (id_pedido, estado) VALUES (?, ?)", (id_pedido, "exitoso"))
+        else:
+            db = obtener_db() # obtenemos la conexion a la base de datos
+            cursor = db.execute( 
+                "INSERT INTO pagos (id_pedido, estado) VALUES (?, ?)",
+                (id_pedido, "exitoso" )
+            ) # insertamos el nuevo pago en la base de datos
+            db.commit()  # guardamos los cambios en la base de datos
+            id_pago = cursor.lastrowid
+    except PoolAgotado:  # es un OperationalError , sin esto lo atraparia la linea de abajo y el cliente recibiria 500 en vez del 503 con Retry-After
+        raise
+    except sqlite3.DatabaseError as e:  # si hay un error en la base de datos , lo manejamos
+        logging.error(f"Error al procesar el pago : {e}")
+        return jsonify({"error": "Error al procesar el pago"}), 500
+    logging.info(f"PAGO PROCESADO: Pedido  {id_pedido} procesado correctamente") # registramos en el log de INFO  , por  la creacion del pago
+    return jsonify({"estado": "exitoso" , "mensaje": "Pago procesado", "id": id_pago}), 201  # devolvemos codigo 201 (creado) al cliente , si todo salio bien
+
+@app.route("/pagos", methods=["GET"])  # endpoint para consultar los pagos de un pedido , ?id_pedido=
+@requiere_autenticacion  # pasa primero por la autenticacion
+def listar_pagos():
+    try:
+        id_pedido = int(request.args["id_pedido"])
+    except KeyError:
+        return jsonify({"error": "Falta el parametro id_pedido"}), 400
+    except ValueError:
+        return jsonify({"error": "id_pedido debe ser un numero entero"}), 400
+    filas = obtener_db().execute(
+        "SELECT id, id_pedido, estado FROM pagos WHERE id_pedido = ? ORDER BY id", (id_pedido,)
+    ).fetchall()  # usa idx_pagos_id_pedido
+    return jsonify([dict(fila) for fila in filas])
 
+@app.route("/pagos/lote", methods=["POST"])  # endpoint para procesar varios pagos de una vez , un solo viaje a pedidos y un solo commit
+@requiere_autenticacion  # pasa primero por la autenticacion
+def procesar_pagos_lote():
+    datos = request.get_json(silent=True)
+    if not isinstance(datos, dict) or not isinstance(datos.get("items"), list) or not datos["items"]:  # el cuerpo tiene que ser un objeto json , no una lista ni un numero
+        return jsonify({"error": "Se espera una lista no vacia en 'items'"}), 400
+    if len(datos["items"]) > MAXIMO_LOTE:
+        return jsonify({"error": f"Un lote admite como maximo {MAXIMO_LOTE} items"}), 400
 
-    db = obtener_db() # obtenemos la conexion a la base de datos
-    db.execute( 
-        "INSERT INTO pagos (id_pedido, estado) VALUES (?, ?)",
-        (id_pedido, "exitoso" )
-    ) # insertamos el nuevo pago en la base de datos
-    db.commit()  # guardamos los cambios en la base de datos
-    logging.info(f"PAGO PROCESADO: Pedido  {id_pedido} procesado correctamente") # registramos en el log de INFO  , por  la creacion del pago
-    return jsonify({"estado": "exitoso" , "mensaje": "Pago procesado"}), 201  # devolvemos codigo 201 (creado) al cliente , si todo salio bien
+    resultados = []  # un resultado por item , en el mismo orden en que llegaron
+    validos = []  # (indice , id_pedido) de los items bien formados
+    for indice, item in enumerate(datos["items"]):  # validamos cada item igual que en procesar_pago
+        if not isinstance(item, dict) or "id_pedido" not in item:
+            resultados.append({"estado": 400, "error": "Datos Incompletos "})
+            continue
+        try:
+            validos.append((indice, int(item["id_pedido"])))
+            resultados.append(None)  # se completa despues de verificar el pedido
+        except (ValueError, TypeError):
+            resultados.append({"estado": 400, "error": "id_pedido debe ser un numero entero"})
 
-if __name__ == "__main__":
+    ids_pedidos = sorted({id_pedido for _, id_pedido in validos})
+    existentes = pedidos_replicados(ids_pedidos)  # los que ya estan en la replica local
+    ids_pedidos = [id_pedido for id_pedido in ids_pedidos if id_pedido not in existentes]  # solo consultamos a pedidos por los que faltan
+    if ids_pedidos:
+        try:  # una sola peticion a pedidos para verificar todos los pedidos del lote
+            respuesta = circuito_pedidos.ejecutar(
+                lambda: cliente_http.get(
+                    f"{URL_SERVICIO_PEDIDOS}?ids={','.join(map(str, ids_pedidos))}",
+                    headers={"Authorization": f"Bearer {TOKEN_SECRETO}"},
+                    destino="pedidos"
+                ),
+                es_fallo=lambda r: r.status_code >= 500  # un error 5xx de pedidos tambien cuenta como fallo del servicio
+            )
+        except CircuitoAbierto:  # el circuito esta abierto , no intentamos la conexion
+            logging.warning(f"CIRCUITO ABIERTO: lote de {len(ids_pedidos)} pagos rechazado sin consultar pedidos")
+            return jsonify({"error": "No se pudo verificar el pedido (circuito abierto hacia pedidos)"}), 503
+        except requests.exceptions.RequestException:  # si no se obtuvo respuesta del servicio de pedidos despues de los reintentos
+            logging.error(f"Fallo Critico: Servicio de pedidos caido al procesar un lote de {len(ids_pedidos)} pagos")
+            return jsonify({"error": "No se pudo verificar el pedido (Servicio pedidos caido o no responde)"}), 503
+        error = manejar_respuesta_pedido(respuesta)  # mismos errores que en la verificacion de un solo pedido
+        if error:
+            return error
+        existentes |= {pedido["id"] for pedido in respuesta.json()}
+
+    a_insertar = []
+    for indice, id_pedido in validos:
+        if id_pedido in existentes:
+            a_insertar.append((indice, id_pedido))
+        else:
+            resultados[indice] = {"estado": 404, "error": "El pedido no existe , pago rechazado"}
+
+    db = obtener_db()
+    try:  # todos los pagos del lote se guardan en una sola transaccion
+        with db:  # el with hace commit al final , o rollback si algo falla
+            for indice, id_pedido in a_insertar:
+                cursor = db.execute("INSERT INTO pagos (id_pedido, estado) VALUES (?, ?)", (id_pedido, "exitoso"))
+                resultados[indice] = {"estado": 201, "id": cursor.lastrowid}
+    except sqlite3.DatabaseError as e:
+        logging.error(f"Error al procesar el lote de pagos : {e}")
+        return jsonify({"error": "Error al procesar el lote de pagos"}), 500
+    logging.info(f"LOTE DE PAGOS: {len(a_insertar)} procesados de {len(resultados)} items")
+    return jsonify({"procesados": len(a_insertar), "resultados": resultados}), 200
+
+@app.route("/cliente_http/estadisticas", methods=["GET"])  # endpoint para ver el uso del pool de conexiones por host , sirve para dimensionarlo
+@requiere_autenticacion  # pasa primero por la autenticacion
+def estadisticas_cliente_http():
+    return jsonify(cliente_http.estadisticas())
+@app.route("/escritura/estadisticas", methods=["GET"])  # endpoint para ver el tamano de los lotes y la latencia del commit agrupado
+@requiere_autenticacion  # pasa primero por la autenticacion
+def estadisticas_escritura():
+    if escritor_agrupado is None:
+        return jsonify({"activo": False})
+    return jsonify(escritor_agrupado.estadisticas())
+
+@app.route("/replica/estado", methods=["GET"])  # endpoint para ver el atraso de la replica y cuantos pagos tuvieron que consultar a pedidos
+@requiere_autenticacion  # pasa primero por la autenticacion
+def estado_replica():
+    if replica_pedidos is None:
+        return jsonify({"activa": False})
+    return jsonify(replica_pedidos.estado(obtener_db()))
+
+@app.route("/idempotencia/estadisticas", methods=["GET"])  # endpoint para ver cuantas peticiones repetidas se respondieron desde el almacen y su tamano
+@requiere_autenticacion  # pasa primero por la autenticacion
+def estadisticas_idempotencia():
+    return jsonify(idempotencia.estadisticas())
+
+@app.route("/async/estadisticas", methods=["GET"])  # endpoint para ver la cola , las peticiones en curso y los rechazos con 429 del modo async
+@requiere_autenticacion  # pasa primero por la autenticacion
+def estadisticas_async():
+    return jsonify(asgi_app.estadisticas())
+
+@app.route("/circuito", methods=["GET"])  # endpoint para ver el estado del circuito hacia el servicio de pedidos
+@requiere_autenticacion  # pasa primero por la autenticacion
+def estado_circuito():
+    return jsonify(circuito_pedidos.estado())
+
+def iniciar_servicio():  # lo que hay que hacer antes de atender peticiones , en cualquiera de los dos modos
     # Inicializar base de datos
     inicializar_db()
-    app.run(port=5002)  # ejecutamos la aplicacion en el puerto 5002
+    if replica_pedidos:
+        replica_pedidos.iniciar()  # arrancamos la sincronizacion en segundo plano
+
+asgi_app = AdaptadorASGI.desde_entorno(app, al_iniciar=iniciar_servicio)  # modo async : uvicorn app:asgi_app
+
+if __name__ == "__main__":
+    if os.environ.get("MODO_ASYNC") == "1":  # servidor asyncio con concurrencia acotada y rechazo con 429 cuando se satura
+        import uvicorn  # dependencia opcional , solo hace falta en modo async
+        uvicorn.run(asgi_app, host="127.0.0.1", port=PUERTO)
+    else:
+        iniciar_servicio()
+        app.run(port=PUERTO)  # ejecutamos la aplicacion en el puerto 5002 (o PAGOS_PUERTO)
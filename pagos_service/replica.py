@@ -0,0 +1,97 @@
+import threading, time, logging   # importamos logging para registrar los errores de sincronizacion
+
+
+class ReplicaPedidos:
+    # replica local (solo lectura) de los pedidos , se mantiene en segundo plano leyendo el feed GET /pedidos/cambios
+    # sirve para verificar pagos sin consultar al servicio de pedidos , si el pedido no esta todavia se consulta por HTTP
+    def __init__(self, pool, cliente_http, url_cambios, token, intervalo=1.0, limite=500):
+        self.pool = pool   # pool de conexiones de la base de pagos , la replica vive en la misma base
+        self.cliente_http = cliente_http
+        self.url_cambios = url_cambios
+        self.token = token
+        self.intervalo = intervalo   # segundos entre consultas al feed cuando ya estamos al dia
+        self.limite = limite   # pedidos por pagina del feed
+        self._candado = threading.Lock()
+        self._ultimo_id_origen = 0   # ultimo id que informo pedidos
+        self._ultima_sincronizacion = None   # momento de la ultima consulta exitosa al feed
+        self._aciertos = 0   # pagos verificados con la replica
+        self._consultas_http = 0   # pagos que tuvieron que consultar a pedidos por no estar en la replica
+        self._errores = 0
+
+    def inicializar_db(self, db):   # crea las tablas de la replica en la base de pagos
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS replica_pedidos (
+                id INTEGER PRIMARY KEY,
+                id_producto INTEGER NOT NULL,
+                cantidad INTEGER NOT NULL,
+                estado TEXT NOT NULL
+            )
+        """)
+        db.execute("CREATE TABLE IF NOT EXISTS replica_cursor (id INTEGER PRIMARY KEY CHECK (id = 1), ultimo_id INTEGER NOT NULL)")
+        db.execute("INSERT OR IGNORE INTO replica_cursor (id, ultimo_id) VALUES (1, 0)")
+        db.commit()
+
+    def iniciar(self):   # arranca el hilo de sincronizacion
+        threading.Thread(target=self._bucle, name="replica-pedidos", daemon=True).start()
+
+    def _bucle(self):
+        while True:
+            try:
+                al_dia = self.sincronizar()
+            except Exception as e:   # el hilo no debe morir , lo intentamos en la proxima vuelta
+                with self._candado:
+                    self._errores += 1
+                logging.warning(f"REPLICA: no se pudo sincronizar con pedidos ({e})")
+                al_dia = True
+            if al_dia:   # si quedaron cambios pendientes seguimos sin esperar
+                time.sleep(self.intervalo)
+
+    def sincronizar(self):
+        # trae una pagina del feed y la guarda , devuelve True si quedamos al dia con pedidos
+        with self.pool.conexion() as db:
+            desde = db.execute("SELECT ultimo_id FROM replica_cursor WHERE id = 1").fetchone()[0]
+        respuesta = self.cliente_http.get(
+            f"{self.url_cambios}?desde={desde}&limite={self.limite}",
+            headers={"Authorization": f"Bearer {self.token}"},
+            destino="pedidos_cambios"
+        )
+        respuesta.raise_for_status()
+        datos = respuesta.json()
+        with self.pool.conexion() as db:
+            with db:   # los pedidos y el cursor se guardan en la misma transaccion
+                db.executemany(
+                    "INSERT OR REPLACE INTO replica_pedidos (id, id_producto, cantidad, estado) VALUES (:id, :id_producto, :cantidad, :estado)",
+                    datos["cambios"]
+                )
+                db.execute("UPDATE replica_cursor SET ultimo_id = ? WHERE id = 1", (datos["siguiente"],))
+        with self._candado:
+            self._ultimo_id_origen = datos["ultimo_id"]
+            self._ultima_sincronizacion = time.time()
+        return datos["siguiente"] >= datos["ultimo_id"]
+
+    def existentes(self, db, ids_pedidos):   # devuelve cuales de los pedidos estan en la replica , y cuenta aciertos y consultas por HTTP
+        ids_pedidos = list(ids_pedidos)
+        encontrados = set()
+        for inicio in range(0, len(ids_pedidos), self.limite):   # de a bloques para no pasarnos del limite de parametros de sqlite
+            bloque = ids_pedidos[inicio:inicio + self.limite]
+            marcadores = ",".join("?" * len(bloque))
+            encontrados.update(fila[0] for fila in db.execute(f"SELECT id FROM replica_pedidos WHERE id IN ({marcadores})", bloque))
+        with self._candado:
+            self._aciertos += len(encontrados)
+            self._consultas_http += len(ids_pedidos) - len(encontrados)
+        return encontrados
+
+    def estado(self, db):   # atraso de la replica y cuantas verificaciones tuvieron que ir por HTTP
+        ultimo_id_local = db.execute("SELECT ultimo_id FROM replica_cursor WHERE id = 1").fetchone()[0]
+        with self._candado:
+            verificaciones = self._aciertos + self._consultas_http
+            return {
+                "ultimo_id_local": ultimo_id_local,
+                "ultimo_id_origen": self._ultimo_id_origen,
+                "atraso_pedidos": max(0, self._ultimo_id_origen - ultimo_id_local),
+                "segundos_desde_sincronizacion": round(time.time() - self._ultima_sincronizacion, 3) if self._ultima_sincronizacion else None,
+                "aciertos": self._aciertos,
+                "consultas_http": self._consultas_http,
+                "tasa_consultas_http": self._consultas_http / verificaciones if verificaciones else 0.0,
+                "errores_sincronizacion": self._errores,
+            }
@@ -2,40 +2,92 @@ from flask import Flask, request,g,jsonify   #importamos g para manejar la conex
 import sqlite3
 import requests , logging  # importamos logging para registrar eventos importantes
 from functools import wraps # decoradores para que flask no pierda informacion de la funcion original
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # agregamos la carpeta raiz del proyecto para poder importar el paquete comun
+from comun.cliente_http import ClienteHTTP  # cliente http compartido con pool de conexiones y reintentos con backoff
+from comun.almacenamiento import PoolConexiones, PoolAgotado  # pool de conexiones sqlite con WAL y pragmas ajustados
+from comun.circuito import Circuito, CircuitoAbierto  # circuit breaker para no esperar timeouts cuando el servicio vecino esta caido
+from comun.cache import CacheLRU  # cache en memoria con TTL y expulsion LRU
+from comun.escritura_agrupada import EscritorAgrupado  # commit agrupado de los INSERT (opcional)
+from comun.servidor_async import AdaptadorASGI  # modo de servicio asyncio (ASGI) con concurrencia acotada
+from comun.metricas import instrumentar  # endpoint /metrics , metricas por ruta y tiempos por etapa
+from comun.idempotencia import AlmacenIdempotencia  # respuestas guardadas por Idempotency-Key , los reintentos no duplican
+from comun.trazas import configurar_logging  # logs con el servicio y el id de la peticion (X-Request-ID)
 
 app = Flask(__name__)
 
 TOKEN_SECRETO = "mi_token_secreto"
-URL_SERVICIO_PRODUCTOS = "http://127.0.0.1:5000/productos"
-NOMBRE_BASE_DATOS = "pedidos.db"
-logging.basicConfig(level=logging.INFO)# configuramos el nivel de logging ,(INFO muestra informacion general del funcionamiento(WARNING, ERROR , CRITICAL))
+URL_SERVICIO_PRODUCTOS = os.environ.get("URL_SERVICIO_PRODUCTOS", "http://127.0.0.1:5000/productos")
+NOMBRE_BASE_DATOS = os.environ.get("PEDIDOS_DB", "pedidos.db")
+PUERTO = int(os.environ.get("PEDIDOS_PUERTO", 5001))  # puerto del servicio
+MAXIMO_LOTE = 500  # cantidad maxima de items en un lote (y de ids en una consulta de varios pedidos)
+configurar_logging("pedidos") # configuramos el nivel de logging ,(INFO muestra informacion general del funcionamiento(WARNING, ERROR , CRITICAL))
+pool_db = PoolConexiones.desde_entorno(NOMBRE_BASE_DATOS)  # conexiones reutilizables a la base de datos , compartidas por todas las peticiones del proceso
+escritor_agrupado = EscritorAgrupado.desde_entorno(pool_db, "PEDIDOS_COMMIT_AGRUPADO")  # None si el commit agrupado no esta activado
+cliente_http = ClienteHTTP.desde_entorno()  # un solo cliente por proceso , reutiliza las conexiones al servicio de productos
+circuito_productos = Circuito.desde_entorno("productos")  # circuito del servicio de productos , si esta caido respondemos 503 al instante
+cache_productos = CacheLRU(  # cache de productos consultados , evita ir a productos en cada pedido
+    capacidad=int(os.environ.get("CACHE_PRODUCTOS_CAPACIDAD", 1000)),
+    ttl=float(os.environ.get("CACHE_PRODUCTOS_TTL", 30.0))
+)
+TTL_PRODUCTO_INEXISTENTE = float(os.environ.get("CACHE_PRODUCTOS_TTL_NEGATIVO", 5.0))  # los 404 se recuerdan menos tiempo , por si el producto se crea despues
 
 
 def obtener_db():
     if "db" not in g:  # si no hay conexion a la base de datos en g
-        g.db = sqlite3.connect(NOMBRE_BASE_DATOS)   # creamos la conexion a la base de datos , y lo guardamos en g , asi mantenemos una sola conexion por peticion
-        g.db.row_factory = sqlite3.Row   # para que las filas devueltas por las consultas sean accesibles como diccionarios , ya que por defecto son tuplas , ya no [0] , sino ['nombre_columna']
+        g.db = pool_db.obtener()   # tomamos una conexion del pool , y la guardamos en g , asi mantenemos una sola conexion por peticion
     return g.db
 
-def inicializar_db():
-    db = sqlite3.connect(NOMBRE_BASE_DATOS)   # funcion para inicializar la base de datos si no existe , con las columnas necesarias
-    db.execute("""
-        CREATE TABLE IF NOT  EXISTS pedidos (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            id_producto INTEGER NOT NULL,
-            cantidad INTEGER NOT NULL,
-            estado TEXT NOT NULL
-        )
-    """)
-    db.commit()   # guardamos los cambios
-    db.close()   # cerramos la conexion a la base de datos
+idempotencia = AlmacenIdempotencia.desde_entorno(pool_db, obtener_db)  # respuestas de POST /pedidos por Idempotency-Key , se guardan con la conexion de la peticion
+
+def inicializar_db():   # funcion para inicializar la base de datos si no existe , con las columnas necesarias
+    with pool_db.conexion() as db:  # tomamos una conexion del pool , al abrirla ya deja la base en modo WAL
+        db.execute("""
+            CREATE TABLE IF NOT  EXISTS pedidos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                id_producto INTEGER NOT NULL,
+                cantidad INTEGER NOT NULL,
+                estado TEXT NOT NULL
+            )
+        """)
+        db.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_id_producto ON pedidos (id_producto)")  # para GET /pedidos?id_producto= sin recorrer toda la tabla
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS resumen_ventas (
+                id_producto INTEGER PRIMARY KEY,
+                pedidos INTEGER NOT NULL,
+                unidades INTEGER NOT NULL
+            )
+        """)  # ventas acumuladas por producto , GET /pedidos/resumen la lee sin hacer un GROUP BY sobre todos los pedidos
+        db.execute("BEGIN IMMEDIATE")  # el trigger y la carga inicial van juntos , asi no se pierde ni se cuenta dos veces ningun pedido
+        if not db.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'sumar_venta'").fetchone():
+            # el trigger mantiene el resumen en la misma transaccion de cada INSERT (pedido suelto , lote o commit agrupado)
+            # los pedidos no se modifican ni se borran , alcanza con sumar al insertar
+            db.execute("""
+                CREATE TRIGGER sumar_venta AFTER INSERT ON pedidos
+                BEGIN
+                    INSERT INTO resumen_ventas (id_producto, pedidos, unidades) VALUES (NEW.id_producto, 1, NEW.cantidad)
+                    ON CONFLICT (id_producto) DO UPDATE SET pedidos = pedidos + 1, unidades = unidades + excluded.unidades;
+                END
+            """)
+            db.execute("DELETE FROM resumen_ventas")  # base que ya tenia pedidos de antes del trigger , el resumen se arma una sola vez
+            db.execute("""
+                INSERT INTO resumen_ventas (id_producto, pedidos, unidades)
+                SELECT id_producto, COUNT(*), SUM(cantidad) FROM pedidos GROUP BY id_producto
+            """)
+        db.commit()   # guardamos los cambios
+        idempotencia.inicializar_db(db)  # tabla de respuestas por Idempotency-Key
 
 
-@app.teardown_appcontext    # decorador de flask que pase lo que pase al finalizar de la peticion cierra la conexion a la base de datos
-def cerrar_db(exception):   # flask cierra la conexion a la base de datos al finalizar la peticion
+@app.teardown_appcontext    # decorador de flask que pase lo que pase al finalizar de la peticion devuelve la conexion al pool
+def cerrar_db(exception):   # flask devuelve la conexion al pool al finalizar la peticion
     db = g.pop('db', None)    # sacamos la conexion a la base de datos si existe en g , si no existe devuelve None
     if db:                      # si existe la conexion a la base de datos
-        db.close()          # cerramos la conexion a la base de datos
+        pool_db.devolver(db)          # la devolvemos al pool para la proxima peticion , sin cerrarla
+
+@app.errorhandler(PoolAgotado)  # no hubo conexion libre a tiempo , respondemos 503 para que el cliente reintente en vez de un 500
+def base_saturada(error):
+    logging.warning(f"POOL AGOTADO: {error}")
+    return jsonify({"error": "Servicio saturado , intente mas tarde"}), 503, {"Retry-After": "1"}
 
 def requiere_autenticacion(funcion):
     @wraps(funcion)
@@ -49,6 +101,8 @@ def requiere_autenticacion(funcion):
     
     return envoltorio
 
+instrumentar(app, requiere_autenticacion)  # /metrics queda protegido con el mismo token que el resto de los endpoints
+
 def manejar_respuesta_producto(respuesta): # funcion para manejar errores del microservicio de productos
     status = respuesta.status_code    # obtenemos el codigo de estado de la respuesta
     if status == 200:   #si todo esta bien no hay error
@@ -62,6 +116,38 @@ def manejar_respuesta_producto(respuesta): # funcion para manejar errores del mi
         return jsonify({"error": "Error en el servicio de productos"}), 503 # devolvemos error 503 al cliente del servicio de pedidos
     
     return jsonify({"error": "Error desconocido al consultar productos"}), 502 # si hay otro error desconocido devolvemos error 502 al cliente del servicio de pedidos
+
+def verificar_producto(id_producto): # verifica que el producto exista , primero en el cache y si no en el microservicio de productos
+    entrada, vigente = cache_productos.obtener(id_producto)
+    if vigente:  # el cache tiene una respuesta reciente , no hace falta consultar productos
+        if entrada["existe"]:
+            return None
+        return jsonify({"error": "Producto no encontrado"}), 404
+
+    encabezados = {"Authorization": f"Bearer {TOKEN_SECRETO}"}
+    if entrada and entrada.get("etag"):  # la entrada vencio pero tenemos su ETag , pedimos a productos que la revalide
+        encabezados["If-None-Match"] = entrada["etag"]
+    try:  # hacemos la peticion al microservicio de productos a traves del circuito , el cliente reintenta con backoff si no responde
+        respuesta = circuito_productos.ejecutar(
+            lambda: cliente_http.get(f"{URL_SERVICIO_PRODUCTOS}/{id_producto}", headers=encabezados, destino="productos"),
+            es_fallo=lambda r: r.status_code >= 500  # un error 5xx de productos tambien cuenta como fallo del servicio
+        )
+    except CircuitoAbierto:  # el circuito esta abierto , no intentamos la conexion
+        logging.warning(f"CIRCUITO ABIERTO: pedido de producto {id_producto} rechazado sin consultar productos")
+        return jsonify({"error": "Servicio de productos no disponible (circuito abierto)"}), 503  # devolvemos error 503 al instante
+    except requests.exceptions.RequestException:  # si despues de los reintentos no se pudo conectar con el microservicio de productos
+        logging.error(f"Fallo Critico: No se pudo conectar con el servicio de productos para pedido de ID {id_producto}")  # registramos un log de error critico , de que  se cayo o no responde el servicio de productos
+        return jsonify({"error": "Servicio de productos no disponible tras varios intentos" }), 503   # devolvemos error 503 al cliente , por que el servicio de productos no esta disponible
+
+    if respuesta.status_code == 304 and entrada:  # el producto no cambio , solo renovamos el vencimiento
+        cache_productos.refrescar(id_producto)
+        return None
+    if respuesta.status_code == 200:  # guardamos el producto para los proximos pedidos
+        cache_productos.guardar(id_producto, {"existe": True, "precio": respuesta.json().get("precio"), "etag": respuesta.headers.get("ETag")})
+    elif respuesta.status_code == 404:  # tambien recordamos que no existe , con un TTL corto
+        cache_productos.guardar(id_producto, {"existe": False}, ttl=TTL_PRODUCTO_INEXISTENTE)
+    #manejamos los errores que pueden venir del servicio de productos
+    return manejar_respuesta_producto(respuesta)
     
     
 @app.route("/pedidos/<int:id_pedido>", methods=["GET"])  # creamos un endpoint para obtener un pedido por su id , para la peticion del microservicio de pagos
@@ -76,8 +162,173 @@ def obtener_pedido(id_pedido):   # funcion para obtener un pedido por su id
     
     return jsonify({"error": "Pedido no encontrado"}), 404  # si no existe el pedido devolvemos error 404
 
+def verificar_productos(ids_productos): # verifica varios productos de una vez , devuelve (ids que existen , error)
+    existentes = set()
+    pendientes = []  # los que no estan vigentes en el cache , se consultan todos juntos
+    for id_producto in ids_productos:
+        entrada, vigente = cache_productos.obtener(id_producto)
+        if vigente:
+            if entrada["existe"]:
+                existentes.add(id_producto)
+        else:
+            pendientes.append(id_producto)
+    if not pendientes:  # todo salio del cache , no hace falta consultar productos
+        return existentes, None
+
+    try:  # una sola peticion a productos para todos los ids pendientes
+        respuesta = circuito_productos.ejecutar(
+            lambda: cliente_http.get(
+                f"{URL_SERVICIO_PRODUCTOS}?ids={','.join(map(str, pendientes))}",
+                headers={"Authorization": f"Bearer {TOKEN_SECRETO}"},
+                destino="productos"
+            ),
+            es_fallo=lambda r: r.status_code >= 500  # un error 5xx de productos tambien cuenta como fallo del servicio
+        )
+    except CircuitoAbierto:  # el circuito esta abierto , no intentamos la conexion
+        logging.warning(f"CIRCUITO ABIERTO: lote de {len(pendientes)} productos rechazado sin consultar productos")
+        return existentes, (jsonify({"error": "Servicio de productos no disponible (circuito abierto)"}), 503)
+    except requests.exceptions.RequestException:  # si despues de los reintentos no se pudo conectar con el microservicio de productos
+        logging.error(f"Fallo Critico: No se pudo conectar con el servicio de productos para un lote de {len(pendientes)} productos")
+        return existentes, (jsonify({"error": "Servicio de productos no disponible tras varios intentos" }), 503)
+
+    error = manejar_respuesta_producto(respuesta)  # mismos errores que en la consulta de un solo producto
+    if error:
+        return existentes, error
+    encontrados = {producto["id"]: producto for producto in respuesta.json()}
+    for id_producto in pendientes:  # actualizamos el cache con lo que respondio productos , incluidos los que no existen
+        if id_producto in encontrados:
+            existentes.add(id_producto)
+            cache_productos.guardar(id_producto, {"existe": True, "precio": encontrados[id_producto]["precio"], "etag": None})
+        else:
+            cache_productos.guardar(id_producto, {"existe": False}, ttl=TTL_PRODUCTO_INEXISTENTE)
+    return existentes, None
+
+
+@app.route("/pedidos", methods=["GET"])  # endpoint para consultar varios pedidos por id en una sola peticion , ?ids=1,2,3 (lo usa pagos para verificar lotes)
+@requiere_autenticacion   # pasa primero por la autenticacion
+def listar_pedidos():
+    if "id_producto" in request.args:  # los pedidos de un producto , ?id_producto=&estado= con paginacion ?after=&limit=
+        return listar_pedidos_producto()
+    try:
+        ids = sorted({int(valor) for valor in request.args.get("ids", "").split(",") if valor.strip()})  # sacamos repetidos y los convertimos a enteros
+    except ValueError:
+        return jsonify({"error": "ids debe ser una lista de numeros enteros separados por coma"}), 400
+    if not ids or len(ids) > MAXIMO_LOTE:
+        return jsonify({"error": f"ids debe tener entre 1 y {MAXIMO_LOTE} elementos"}), 400
+    marcadores = ",".join("?" * len(ids))  # un ? por cada id , nunca armamos la consulta con los valores directamente
+    cursor = obtener_db().execute(f"SELECT id, id_producto, cantidad, estado FROM pedidos WHERE id IN ({marcadores})", ids)
+    return jsonify([dict(fila) for fila in cursor.fetchall()])  # solo vienen los que existen
+
+def listar_pedidos_producto():
+    try:
+        id_producto = int(request.args["id_producto"])
+        despues_de = int(request.args.get("after", 0))
+        limite = int(request.args.get("limit", 100))
+    except ValueError:
+        return jsonify({"error": "id_producto , after y limit deben ser numeros enteros"}), 400
+    if limite <= 0 or limite > MAXIMO_LOTE:
+        return jsonify({"error": f"limit debe estar entre 1 y {MAXIMO_LOTE}"}), 400
+    consulta = "SELECT id, id_producto, cantidad, estado FROM pedidos WHERE id_producto = ? AND id > ?"
+    parametros = [id_producto, despues_de]
+    if request.args.get("estado"):
+        consulta += " AND estado = ?"
+        parametros.append(request.args["estado"])
+    filas = obtener_db().execute(consulta + " ORDER BY id LIMIT ?", parametros + [limite]).fetchall()  # usa idx_pedidos_id_producto , que ya viene ordenado por id
+    siguiente = filas[-1]["id"] if len(filas) == limite else None  # si la pagina vino llena puede haber mas
+    return jsonify({"pedidos": [dict(fila) for fila in filas], "siguiente": siguiente})
+
+@app.route("/pedidos/resumen", methods=["GET"])  # ventas por producto (cantidad de pedidos y unidades) , ?id_producto= para uno solo
+@requiere_autenticacion   # pasa primero por la autenticacion
+def resumen_ventas():
+    db = obtener_db()
+    if "id_producto" in request.args:  # un producto : una sola lectura por clave primaria , no depende de cuantos pedidos haya
+        try:
+            id_producto = int(request.args["id_producto"])
+        except ValueError:
+            return jsonify({"error": "id_producto debe ser un numero entero"}), 400
+        fila = db.execute("SELECT id_producto, pedidos, unidades FROM resumen_ventas WHERE id_producto = ?", (id_producto,)).fetchone()
+        return jsonify(dict(fila) if fila else {"id_producto": id_producto, "pedidos": 0, "unidades": 0})
+    filas = db.execute("SELECT id_producto, pedidos, unidades FROM resumen_ventas ORDER BY id_producto").fetchall()  # una fila por producto vendido
+    return jsonify([dict(fila) for fila in filas])
+
+@app.route("/pedidos/cambios", methods=["GET"])  # feed de cambios : los pedidos con id mayor a ?desde= , lo usa pagos para mantener su replica local
+@requiere_autenticacion   # pasa primero por la autenticacion
+def cambios_pedidos():
+    try:
+        desde = int(request.args.get("desde", 0))
+        limite = int(request.args.get("limite", MAXIMO_LOTE))
+    except ValueError:
+        return jsonify({"error": "desde y limite deben ser numeros enteros"}), 400
+    if limite <= 0 or limite > MAXIMO_LOTE:
+        return jsonify({"error": f"limite debe estar entre 1 y {MAXIMO_LOTE}"}), 400
+    db = obtener_db()
+    filas = db.execute(
+        "SELECT id, id_producto, cantidad, estado FROM pedidos WHERE id > ? ORDER BY id LIMIT ?", (desde, limite)
+    ).fetchall()  # los pedidos no se modifican ni se borran , alcanza con avanzar por id
+    ultimo_id = db.execute("SELECT COALESCE(MAX(id), 0) FROM pedidos").fetchone()[0]  # para que el que consulta sepa cuanto le falta
+    return jsonify({
+        "cambios": [dict(fila) for fila in filas],
+        "siguiente": filas[-1]["id"] if filas else desde,  # cursor para la proxima consulta
+        "ultimo_id": ultimo_id
+    })
+
+@app.route("/pedidos/lote", methods=["POST"])  # endpoint para crear varios pedidos de una vez , un solo viaje a productos y un solo commit
+@requiere_autenticacion  # pasa primero por la autenticacion
+def crear_pedidos_lote():
+    datos = request.get_json(silent=True)
+    if not isinstance(datos, dict) or not isinstance(datos.get("items"), list) or not datos["items"]:  # el cuerpo tiene que ser un objeto json , no una lista ni un numero
+        return jsonify({"error": "Se espera una lista no vacia en 'items'"}), 400
+    if len(datos["items"]) > MAXIMO_LOTE:
+        return jsonify({"error": f"Un lote admite como maximo {MAXIMO_LOTE} items"}), 400
+
+    resultados = []  # un resultado por item , en el mismo orden en que llegaron
+    validos = []  # (indice , id_producto , cantidad) de los items bien formados
+    for indice, item in enumerate(datos["items"]):  # validamos cada item igual que en crear_pedido
+        if not isinstance(item, dict) or "id_producto" not in item or "cantidad" not in item:
+            resultados.append({"estado": 400, "error": " Datos incompletos "})
+            continue
+        try:
+            id_producto = int(item["id_producto"])
+            cantidad = int(item["cantidad"])
+        except (ValueError, TypeError):
+            resultados.append({"estado": 400, "error": "id_producto y cantidad deben ser numeros enteros"})
+            continue
+        if cantidad <= 0 or id_producto <= 0:
+            resultados.append({"estado": 400, "error": "id_producto y cantidad deben ser numeros enteros positivos"})
+            continue
+        resultados.append(None)  # se completa despues de verificar el producto
+        validos.append((indice, id_producto, cantidad))
+
+    existentes, error = verificar_productos(sorted({id_producto for _, id_producto, _ in validos}))
+    if error:  # si no pudimos verificar los productos no guardamos nada del lote
+        return error
+
+    a_insertar = []
+    for indice, id_producto, cantidad in validos:
+        if id_producto in existentes:
+            a_insertar.append((indice, id_producto, cantidad))
+        else:
+            resultados[indice] = {"estado": 404, "error": "Producto no encontrado"}
+
+    conexion = obtener_db()
+    try:  # todos los pedidos del lote se guardan en una sola transaccion
+        with conexion:  # el with hace commit al final , o rollback si algo falla
+            for indice, id_producto, cantidad in a_insertar:
+                cursor = conexion.execute(
+                    "INSERT INTO pedidos (id_producto, cantidad, estado) VALUES (?, ?, ?)",
+                    (id_producto, cantidad, "creado")
+                )
+                resultados[indice] = {"estado": 201, "id": cursor.lastrowid}
+    except sqlite3.DatabaseError as e:
+        logging.error(f"Error al crear el lote de pedidos : {e}")
+        return jsonify({"error": "Error al crear el lote de pedidos"}), 500
+    logging.info(f"LOTE DE PEDIDOS: {len(a_insertar)} creados de {len(resultados)} items")
+    return jsonify({"creados": len(a_insertar), "resultados": resultados}), 200
+
+
 @app.route("/pedidos", methods=["POST"])  # creamos un endpoint para crear un nuevo pedido
 @requiere_autenticacion  # pasa primero por la autenticacion
+@idempotencia.idempotente  # si la Idempotency-Key ya se uso devolvemos la respuesta original sin consultar productos ni guardar otro pedido
 def crear_pedido():  # funcion para crear un nuevo pedido
     datos = request.json   # obtenemos los datos de la peticion en formato json
     # verificamos si llega la informacion necesaria , para guardar el pedido
@@ -92,46 +343,76 @@ def crear_pedido():  # funcion para crear un nuevo pedido
     except (ValueError, TypeError):  # si hay un error al convertir los datos a enteros
         return jsonify({"error": "id_producto y cantidad deben ser numeros enteros"}), 400  # devolvemos error 400 al cliente , por que los datos no son validos
 
-    # Verificar producto en microservicio Productos
-    respuesta = None  # una bandera para saber si la respuesta fue exitosa
-    for intento in range(3):  # un retry de 3 intentos para conectarse al microservicio de productos
-
-        try:  # hacemos la peticion al microservicio de productos
-            respuesta = requests.get(
-            f"{URL_SERVICIO_PRODUCTOS}/{id_producto}", 
-                headers={"Authorization": f"Bearer {TOKEN_SECRETO}"},
-                timeout=3
-            ) # esperamos 3 segundos maximo por la respuesta
-            break
-        except requests.exceptions.RequestException:   # si hay un error en la peticion
-            logging.warning(f"REINTENTO {intento + 1}: Servicio de productos no responde")  # registramos un log de advertencia , de que el servicio de productos no respondio
-            respuesta = None  # aseguramos que la respuesta sea None en caso de error , para que siga reintentando la conexion
-    
-    if respuesta is None:  # si despues de los reintentos no se pudo conectar con el microservicio de productos
-        logging.error(f"Fallo Critico: No se pudo conectar con el servicio de productos para pedido de ID {id_producto}")  # registramos un log de error critico , de que  se cayo o no responde el servicio de productos
-        return jsonify({"error": "Servicio de productos no disponible tras varios intentos" }), 503   # devolvemos error 503 al cliente , por que el servicio de productos no esta disponible
-    #manejamos los errores que pueden venir del servicio de productos
-    error = manejar_respuesta_producto(respuesta)   
+    # Verificar producto en el cache local o en el microservicio Productos
+    error = verificar_producto(id_producto)
     if error:  # si hay un error , lo devolvemos al cliente
         return error
 
-    conexion = obtener_db()
-    cursor = conexion.cursor()
     try:           # guardamos el pedido en la base de datos
-        cursor.execute(
-            "INSERT INTO pedidos (id_producto, cantidad, estado) VALUES (?, ?, ?)",
-            (id_producto, cantidad, "creado")
-        )
-        conexion.commit() # guardamos los cambios  en la base de datos
-        logging.info(f"PEDIDO CREADO: ID {cursor.lastrowid} para producto {id_producto}") # registramos un log de info , de que se creo un nuevo pedido 
+        if escritor_agrupado:  # con commit agrupado el INSERT se guarda junto con los de otras peticiones
+            id_pedido = escritor_agrupado.insertar(
+                "INSERT INTO pedidos (id_producto, cantidad, estado) VALUES (?, ?, ?)",
+                (id_producto, cantidad, "creado")
+            )
+        else:
+            conexion = obtener_db()
+            cursor = conexion.cursor()
+            cursor.execute(
+                "INSERT INTO pedidos (id_producto, cantidad, estado) VALUES (?, ?, ?)",
+                (id_producto, cantidad, "creado")
+            )
+            conexion.commit() # guardamos los cambios  en la base de datos
+            id_pedido = cursor.lastrowid
+        logging.info(f"PEDIDO CREADO: ID {id_pedido} para producto {id_producto}") # registramos un log de info , de que se creo un nuevo pedido 
+    except PoolAgotado:  # es un OperationalError , sin esto lo atraparia la linea de abajo y el cliente recibiria 500 en vez del 503 con Retry-After
+        raise
     except sqlite3.DatabaseError as e: #si hay un error en la base de datos , lo manejamos
         logging.error(f"Error al crear el pedido : {e}")  # registramos un log de error , de que hubo un error al crear el pedido , en la base de datos
         return jsonify({"error": "Error al crear el pedido"}), 500  # devolvemos error 500 al cliente , por que hubo un error en la base de datos
     
-    return jsonify({"mensaje": "Pedido creado correctamente"}), 201  # devolvemos codigo 201 (creado) al cliente , si paso todo bien
+    return jsonify({"mensaje": "Pedido creado correctamente", "id": id_pedido}), 201  # devolvemos codigo 201 (creado) al cliente , si paso todo bien
+
+
+@app.route("/cliente_http/estadisticas", methods=["GET"])  # endpoint para ver el uso del pool de conexiones por host , sirve para dimensionarlo
+@requiere_autenticacion  # pasa primero por la autenticacion
+def estadisticas_cliente_http():
+    return jsonify(cliente_http.estadisticas())
+
+@app.route("/cache/estadisticas", methods=["GET"])  # endpoint para ver aciertos , fallos y expulsiones del cache de productos
+@requiere_autenticacion  # pasa primero por la autenticacion
+def estadisticas_cache():
+    return jsonify(cache_productos.estadisticas())
+
+@app.route("/escritura/estadisticas", methods=["GET"])  # endpoint para ver el tamano de los lotes y la latencia del commit agrupado
+@requiere_autenticacion  # pasa primero por la autenticacion
+def estadisticas_escritura():
+    if escritor_agrupado is None:
+        return jsonify({"activo": False})
+    return jsonify(escritor_agrupado.estadisticas())
+
+@app.route("/idempotencia/estadisticas", methods=["GET"])  # endpoint para ver cuantas peticiones repetidas se respondieron desde el almacen y su tamano
+@requiere_autenticacion  # pasa primero por la autenticacion
+def estadisticas_idempotencia():
+    return jsonify(idempotencia.estadisticas())
+
+@app.route("/async/estadisticas", methods=["GET"])  # endpoint para ver la cola , las peticiones en curso y los rechazos con 429 del modo async
+@requiere_autenticacion  # pasa primero por la autenticacion
+def estadisticas_async():
+    return jsonify(asgi_app.estadisticas())
+
+@app.route("/circuito", methods=["GET"])  # endpoint para ver el estado del circuito hacia el servicio de productos
+@requiere_autenticacion  # pasa primero por la autenticacion
+def estado_circuito():
+    return jsonify(circuito_productos.estado())
+
 
+asgi_app = AdaptadorASGI.desde_entorno(app, al_iniciar=inicializar_db)  # modo async : uvicorn app:asgi_app (inicializa la base al arrancar)
 
 if __name__ == "__main__":
-    inicializar_db()  # Inicializar base de datos
-    app.run(port=5001)  # ejecutamos la aplicacion en el puerto 5001
+    if os.environ.get("MODO_ASYNC") == "1":  # servidor asyncio con concurrencia acotada y rechazo con 429 cuando se satura
+        import uvicorn  # dependencia opcional , solo hace falta en modo async
+        uvicorn.run(asgi_app, host="127.0.0.1", port=PUERTO)
+    else:
+        inicializar_db()  # Inicializar base de datos
+        app.run(port=PUERTO)  # ejecutamos la aplicacion en el puerto 5001 (o PEDIDOS_PUERTO)
 
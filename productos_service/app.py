@@ -1,37 +1,58 @@
-from flask import Flask, request, jsonify, g #importamos g para manejar la conexion a la base de datos , guarda datos durante el request
-import sqlite3 , logging   # importamos logging para registrar eventos importantes
+from flask import Flask, request, jsonify, g, Response #importamos g para manejar la conexion a la base de datos , guarda datos durante el request
+import logging   # importamos logging para registrar eventos importantes
+import json, zlib   # json para armar la respuesta por partes , zlib para comprimir con gzip mientras se envia
+import hashlib, time   # hashlib para calcular el ETag de cada producto , time para la fecha de modificacion
+from datetime import datetime, timezone
 from functools import wraps # decoradores para que flask no pierda informacion de la funcion original , evita que la funcion envuelta pierda su identidad
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # agregamos la carpeta raiz del proyecto para poder importar el paquete comun
+from comun.almacenamiento import PoolConexiones, PoolAgotado  # pool de conexiones sqlite con WAL y pragmas ajustados
+from comun.metricas import instrumentar  # endpoint /metrics , metricas por ruta y tiempos por etapa
+from comun.trazas import configurar_logging  # logs con el servicio y el id de la peticion (X-Request-ID)
 
 app = Flask(__name__)  #creamos la aplicacion flask
-BASE_DE_DATOS = 'productos.db'
+BASE_DE_DATOS = os.environ.get("PRODUCTOS_DB", 'productos.db')
+PUERTO = int(os.environ.get("PRODUCTOS_PUERTO", 5000))  # puerto del servicio
 TOKEN_SECRETO = "mi_token_secreto"
+MAXIMO_IDS = 500  # cantidad maxima de ids en una consulta de varios productos
+CAMPOS_PRODUCTO = ("id", "nombre", "precio")  # campos que se pueden pedir con ?campos=
+MAXIMO_PAGINA = 1000  # limite maximo de productos por pagina
+TAMANO_BLOQUE = 500  # filas que se leen del cursor por vez al enviar el listado completo
 
-logging.basicConfig(level=logging.INFO) # configuramos el nivel de logging ,(INFO muestra informacion general del funcionamiento(WARNING, ERROR , CRITICAL))
+configurar_logging("productos") # configuramos el nivel de logging ,(INFO muestra informacion general del funcionamiento(WARNING, ERROR , CRITICAL))
+pool_db = PoolConexiones.desde_entorno(BASE_DE_DATOS)  # conexiones reutilizables a la base de datos , compartidas por todas las peticiones del proceso
+pool_listados = PoolConexiones.desde_entorno(  # conexiones aparte para el listado completo (sin ?ids= ni paginacion) , un cliente lento no le saca conexiones a GET /productos/<id>
+    BASE_DE_DATOS,
+    tamano=int(os.environ.get("PRODUCTOS_LISTADOS_SIMULTANEOS", 4)),
+    espera=float(os.environ.get("PRODUCTOS_LISTADOS_ESPERA", 0.5))
+)
 
 def obtener_db():
     if 'db' not in g:  # si no hay conexion a la base de datos en g
-        g.db = sqlite3.connect(BASE_DE_DATOS) # creamos la conexion a la base de datos , y lo guardamos en g , asi mantenemos una sola conexion por peticion
-        g.db.row_factory = sqlite3.Row  # para que las filas devueltas por las consultas sean accesibles como diccionarios , ya que por defecto son tuplas , ya no [0] , sino ['nombre_columna']
+        g.db = pool_db.obtener() # tomamos una conexion del pool , y la guardamos en g , asi mantenemos una sola conexion por peticion (ya viene con row_factory = sqlite3.Row)
     return g.db
 
 
 def inicializar_db():     # funcion para inicializar la base de datos si no existe , con las columnas necesarias
-    db = sqlite3.connect(BASE_DE_DATOS)
-    db.execute("""
-        CREATE TABLE IF NOT EXISTS productos (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nombre TEXT NOT NULL,
-            precio REAL NOT NULL
-        )
-        """)
-    db.commit()  # guardamos los cambios
-    db.close() # cerramos la conexion a la base de datos
-
-@app.teardown_appcontext   # decorador de flask que pase lo que pase al finalizar de la peticion cierra la conexion a la base de datos
-def cerrar_db(exception):     # flask cierra la conexion a la base de datos al finalizar la peticion
+    with pool_db.conexion() as db:  # tomamos una conexion del pool , al abrirla ya deja la base en modo WAL
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS productos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                nombre TEXT NOT NULL,
+                precio REAL NOT NULL,
+                actualizado_en INTEGER NOT NULL DEFAULT 0
+            )
+            """)
+        columnas = [fila[1] for fila in db.execute("PRAGMA table_info(productos)")]  # las bases creadas antes no tienen la columna de fecha de modificacion
+        if "actualizado_en" not in columnas:
+            db.execute("ALTER TABLE productos ADD COLUMN actualizado_en INTEGER NOT NULL DEFAULT 0")
+        db.commit()  # guardamos los cambios
+
+@app.teardown_appcontext   # decorador de flask que pase lo que pase al finalizar de la peticion devuelve la conexion al pool
+def cerrar_db(exception):     # flask devuelve la conexion al pool al finalizar la peticion
     db = g.pop('db', None)   # sacamos la conexion a la base de datos si existe en g , si no existe devuelve None
     if db:         # si existe la conexion a la base de datos
-        db.close()    # cerramos la conexion a la base de datos
+        pool_db.devolver(db)    # la devolvemos al pool para la proxima peticion , sin cerrarla
 
 
 def requiere_autenticacion(funcion):  # decorador para requerir autenticacion en los endpoints
@@ -44,25 +65,125 @@ def requiere_autenticacion(funcion):  # decorador para requerir autenticacion en
         return funcion(*args, **kwargs)
     return envoltorio
 
+instrumentar(app, requiere_autenticacion)  # /metrics queda protegido con el mismo token que el resto de los endpoints
+
+def comprimir_gzip(partes):  # comprime las partes a medida que se generan , sin juntar toda la respuesta en memoria
+    compresor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 genera formato gzip
+    for parte in partes:
+        datos = compresor.compress(parte.encode())
+        if datos:  # el compresor acumula hasta tener un bloque , solo enviamos cuando devuelve algo
+            yield datos
+    yield compresor.flush()
+
+def responder_por_partes(partes, tipo, encabezados=None):  # arma una respuesta que se envia mientras se genera , con gzip si el cliente lo acepta
+    usar_gzip = request.accept_encodings["gzip"] > 0  # respeta la calidad , con gzip;q=0 el cliente pide no comprimir
+    cuerpo = comprimir_gzip(partes) if usar_gzip else (parte.encode() for parte in partes)
+    respuesta = Response(cuerpo, mimetype=tipo, headers=encabezados)
+    if usar_gzip:
+        respuesta.headers["Content-Encoding"] = "gzip"
+    respuesta.vary.add("Accept-Encoding")
+    return respuesta
+
+def generar_listado(db, consulta, parametros, campos, ndjson):  # genera el listado desde el cursor de a bloques , la memoria no depende del tamano de la tabla
+    cursor = db.execute(consulta, parametros)
+    if not ndjson:
+        yield "["
+    primero = True
+    while True:
+        filas = cursor.fetchmany(TAMANO_BLOQUE)
+        if not filas:
+            break
+        partes = [json.dumps({campo: fila[campo] for campo in campos}) for fila in filas]
+        if ndjson:  # NDJSON: un producto por linea
+            yield "\n".join(partes) + "\n"
+        else:
+            yield ("" if primero else ",") + ",".join(partes)
+        primero = False
+    if not ndjson:
+        yield "]"
+
+def responder_listado(consulta, parametros, campos, ndjson, tipo):
+    # el listado usa su propia conexion de pool_listados , la de g se devuelve al terminar la peticion y el cuerpo se sigue enviando despues
+    # la pedimos antes de responder , si estan todas ocupadas lanza PoolAgotado y el cliente recibe 503 en vez de quedar esperando
+    db = pool_listados.obtener()
+    try:
+        respuesta = responder_por_partes(generar_listado(db, consulta, parametros, campos, ndjson), tipo)
+    except Exception:
+        pool_listados.devolver(db)
+        raise
+    respuesta.call_on_close(lambda: pool_listados.devolver(db))  # se ejecuta al terminar el envio , o si el cliente corta la conexion a mitad
+    return respuesta
+
+@app.errorhandler(PoolAgotado)  # no hubo conexion libre a tiempo , respondemos 503 para que el cliente reintente en vez de un 500
+def base_saturada(error):
+    logging.warning(f"POOL AGOTADO: {error}")
+    return jsonify({"error": "Servicio saturado , intente mas tarde"}), 503, {"Retry-After": "1"}
+
 @app.route("/productos", methods=["GET"])     # endpoint para listar todos los productos que hay en la base de datos
 @requiere_autenticacion   # pasa primero por la autenticacion
-def listar_productos(): # funcion para listar todos los productos
+def listar_productos(): # funcion para listar los productos , admite ?ids= , paginacion con ?after=&limit= , ?campos= y formato NDJSON
 
-    db = obtener_db() # obtenemos la conexion a la base de datos
-    cursor = db.execute("SELECT id, nombre, precio FROM productos")   # consulta para obtener todos los productos
-    lista_productos = [dict(fila) for fila in cursor.fetchall()]  # convertimos cada fila del resultado de la consulta en un diccionario y lo guardamos en una lista
-    
-    return jsonify(lista_productos)  # devolvemos la lista de productos en formato json
+    campos = CAMPOS_PRODUCTO
+    if request.args.get("campos"):  # seleccion de campos , solo se aceptan columnas conocidas
+        campos = tuple(campo.strip() for campo in request.args["campos"].split(",") if campo.strip())
+        if not campos or any(campo not in CAMPOS_PRODUCTO for campo in campos):
+            return jsonify({"error": f"campos debe ser una lista de {', '.join(CAMPOS_PRODUCTO)}"}), 400
+    columnas = ", ".join(dict.fromkeys(("id",) + campos))  # siempre leemos el id , hace falta para el cursor de paginacion
+    ndjson = request.args.get("formato") == "ndjson" or \
+        request.accept_mimetypes.best_match(["application/json", "application/x-ndjson"]) == "application/x-ndjson"
+    tipo = "application/x-ndjson" if ndjson else "application/json"
+
+    if "ids" in request.args:  # consulta de varios productos en una sola peticion (la usa el servicio de pedidos para validar lotes)
+        try:
+            ids = sorted({int(valor) for valor in request.args["ids"].split(",") if valor.strip()})  # sacamos repetidos y los convertimos a enteros
+        except ValueError:
+            return jsonify({"error": "ids debe ser una lista de numeros enteros separados por coma"}), 400
+        if not ids or len(ids) > MAXIMO_IDS:  # limitamos la cantidad para no pasarnos del limite de parametros de sqlite
+            return jsonify({"error": f"ids debe tener entre 1 y {MAXIMO_IDS} elementos"}), 400
+        marcadores = ",".join("?" * len(ids))  # un ? por cada id , nunca armamos la consulta con los valores directamente
+        consulta = f"SELECT {columnas} FROM productos WHERE id IN ({marcadores})"
+        # son a lo sumo MAXIMO_IDS filas : se leen de una vez con la conexion de la peticion , sin ocupar una de pool_listados
+        filas = obtener_db().execute(consulta, ids).fetchall()
+        productos = [{campo: fila[campo] for campo in campos} for fila in filas]  # solo vienen los que existen , el que consulta compara con los que pidio
+        if ndjson:
+            return responder_por_partes(iter([json.dumps(producto) + "\n" for producto in productos]), tipo)
+        return jsonify(productos)
+
+    if "after" in request.args or "limit" in request.args:  # paginacion por cursor : los productos con id mayor a after , ordenados por id
+        try:
+            despues_de = int(request.args.get("after", 0))
+            limite = int(request.args.get("limit", 100))
+        except ValueError:
+            return jsonify({"error": "after y limit deben ser numeros enteros"}), 400
+        if limite <= 0 or limite > MAXIMO_PAGINA:
+            return jsonify({"error": f"limit debe estar entre 1 y {MAXIMO_PAGINA}"}), 400
+        filas = obtener_db().execute(
+            f"SELECT {columnas} FROM productos WHERE id > ? ORDER BY id LIMIT ?", (despues_de, limite)
+        ).fetchall()  # usa el indice de la clave primaria , el costo no depende de en que pagina estemos
+        siguiente = filas[-1]["id"] if len(filas) == limite else None  # si la pagina vino llena puede haber mas
+        productos = [{campo: fila[campo] for campo in campos} for fila in filas]
+        if ndjson:  # en NDJSON el cursor de la pagina siguiente va en un encabezado
+            encabezados = {"X-Siguiente-Cursor": str(siguiente)} if siguiente is not None else None
+            return responder_por_partes(iter([json.dumps(producto) + "\n" for producto in productos]), tipo, encabezados)
+        return responder_por_partes(iter([json.dumps({"productos": productos, "siguiente": siguiente})]), tipo)
+
+    consulta = f"SELECT {columnas} FROM productos ORDER BY id"   # consulta para obtener todos los productos , se envian a medida que se leen
+    return responder_listado(consulta, (), campos, ndjson, tipo)  # devolvemos la lista de productos en formato json , es el unico listado sin limite y el unico que usa pool_listados
 
 @app.route("/productos/<int:id_producto>", methods=["GET"]) # un endpoint para la consulta del servidor de pedidos , obtener un producto por su id
 @requiere_autenticacion    # pasa primero por la autenticacion
 def obtener_producto(id_producto): 
     # funcion para obtener un producto por su id
     db = obtener_db()
-    cursor = db.execute("SELECT id, nombre, precio FROM productos WHERE id=?", (id_producto,)) # consulta para obtener el producto por su id en la base de datos
+    cursor = db.execute("SELECT id, nombre, precio, actualizado_en FROM productos WHERE id=?", (id_producto,)) # consulta para obtener el producto por su id en la base de datos
     producto = cursor.fetchone() # obtenemos la primera fila del resultado de la consulta
     if producto: # si existe el producto en la base de datos
-        return jsonify(dict(producto))    # devolvemos el producto como un diccionario en formato json
+        datos = {"id": producto["id"], "nombre": producto["nombre"], "precio": producto["precio"]}
+        respuesta = jsonify(datos)    # devolvemos el producto como un diccionario en formato json
+        respuesta.set_etag(hashlib.sha1(f"{datos}{producto['actualizado_en']}".encode()).hexdigest())  # el ETag cambia si cambia cualquier dato del producto
+        if producto["actualizado_en"]:  # los productos migrados de una base vieja no tienen fecha
+            respuesta.last_modified = datetime.fromtimestamp(producto["actualizado_en"], timezone.utc)
+        return respuesta.make_conditional(request)  # si el cliente manda If-None-Match / If-Modified-Since y no cambio , devolvemos 304 sin cuerpo
     
     return jsonify({"error": "Producto no encontrado"}), 404  # si no existe el producto devolvemos error 404
 
@@ -81,8 +202,8 @@ def crear_producto():   # funcion para crear un nuevo producto
      
     db = obtener_db()
     cursor = db.execute(
-        "INSERT INTO productos (nombre, precio) VALUES (?, ?)",
-        (nombre, precio)
+        "INSERT INTO productos (nombre, precio, actualizado_en) VALUES (?, ?, ?)",
+        (nombre, precio, int(time.time()))
     ) # insertamos el nuevo producto en la base de datos
     db.commit() # guardamos los cambios en la base de datos
     logging.info(f"PRODUCTO CREADO: {nombre}, - ID: {cursor.lastrowid}")  # registramos en el log la creacion del producto
@@ -91,4 +212,4 @@ def crear_producto():   # funcion para crear un nuevo producto
 if __name__ == "__main__":
     # Inicializar base de datos
     inicializar_db()
-    app.run(port=5000)            # ejecutamos la aplicacion en el puerto 5000
+    app.run(port=PUERTO)            # ejecutamos la aplicacion en el puerto 5000 (o PRODUCTOS_PUERTO)
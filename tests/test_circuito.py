@@ -0,0 +1,93 @@
+import os, sys, threading, time, unittest
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # agregamos la carpeta raiz del proyecto para poder importar el paquete comun
+from comun.circuito import Circuito, CircuitoAbierto, ABIERTO, CERRADO, SEMI_ABIERTO
+
+
+def fallar():
+    raise ConnectionError("servicio caido")
+
+
+class LlamadaControlada:   # llamada que se queda esperando en un hilo hasta que el test la suelta
+    def __init__(self, circuito, falla):
+        self.entro = threading.Event()
+        self.soltar = threading.Event()
+        self.falla = falla
+        self.error = None
+        self.hilo = threading.Thread(target=self._correr, args=(circuito,))
+
+    def _funcion(self):
+        self.entro.set()
+        self.soltar.wait(5)
+        if self.falla:
+            fallar()
+        return "ok"
+
+    def _correr(self, circuito):
+        try:
+            circuito.ejecutar(self._funcion)
+        except Exception as e:
+            self.error = e
+
+    def iniciar(self):
+        self.hilo.start()
+        assert self.entro.wait(5)
+
+    def terminar(self):
+        self.soltar.set()
+        self.hilo.join(5)
+
+
+class PruebaCircuito(unittest.TestCase):
+    def nuevo_circuito(self):
+        return Circuito("prueba", ventana=4, minimo_llamadas=2, umbral_fallos=0.5, enfriamiento=0.05)
+
+    def abrir(self, circuito):
+        for _ in range(2):
+            with self.assertRaises(ConnectionError):
+                circuito.ejecutar(fallar)
+        self.assertEqual(circuito.estado()["estado"], ABIERTO)
+
+    def test_prueba_exitosa_cierra(self):
+        circuito = self.nuevo_circuito()
+        self.abrir(circuito)
+        with self.assertRaises(CircuitoAbierto):
+            circuito.ejecutar(lambda: "ok")
+        time.sleep(0.06)
+        self.assertEqual(circuito.ejecutar(lambda: "ok"), "ok")
+        self.assertEqual(circuito.estado()["estado"], CERRADO)
+
+    def test_llamada_vieja_no_decide_la_prueba(self):
+        # una llamada lenta que empezo con el circuito cerrado termina bien mientras la prueba esta en curso
+        circuito = self.nuevo_circuito()
+        lenta = LlamadaControlada(circuito, falla=False)
+        lenta.iniciar()
+        self.abrir(circuito)
+        time.sleep(0.06)
+        prueba = LlamadaControlada(circuito, falla=True)
+        prueba.iniciar()
+        self.assertEqual(circuito.estado()["estado"], SEMI_ABIERTO)
+
+        lenta.terminar()
+        self.assertIsNone(lenta.error)
+        self.assertEqual(circuito.estado()["estado"], SEMI_ABIERTO)   # el exito viejo no cierra el circuito
+        with self.assertRaises(CircuitoAbierto):   # y tampoco deja pasar una segunda prueba
+            circuito.ejecutar(lambda: "ok")
+
+        prueba.terminar()
+        self.assertIsInstance(prueba.error, ConnectionError)
+        self.assertEqual(circuito.estado()["estado"], ABIERTO)   # la prueba fallida vuelve a abrir
+
+    def test_fallo_viejo_no_cuenta_en_la_ventana_nueva(self):
+        circuito = self.nuevo_circuito()
+        lenta = LlamadaControlada(circuito, falla=True)
+        lenta.iniciar()
+        self.abrir(circuito)
+        time.sleep(0.06)
+        circuito.ejecutar(lambda: "ok")   # la prueba cierra el circuito
+        lenta.terminar()
+        self.assertEqual(circuito.estado()["estado"], CERRADO)
+        self.assertEqual(circuito.estado()["llamadas_en_ventana"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()